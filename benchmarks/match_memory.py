@@ -0,0 +1,40 @@
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+
+from finney.domain_objects import Match
+
+
+@dataclass
+class LegacyMatch:  # Match as it was before it had slots
+    path: Path
+    match: str
+    line: int = 0
+
+    def __hash__(self):
+        return hash(self.path.name + self.match)
+
+
+def measure(make, count: int, paths: list) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    matches = [make(paths[i % len(paths)], f"candidate_{i}", i) for i in range(count)]
+    deduped = set(matches)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert len(deduped) == count
+    return size
+
+
+def compare(count: int = 200_000, files: int = 5_000):
+    paths = [f"src/pkg_{i % 50}/module_{i}.py" for i in range(files)]
+    # the legacy scanner made one Path per file, shared by all of its matches
+    legacy = measure(LegacyMatch, count, [Path(p) for p in paths])
+    compact = measure(lambda p, m, i: Match(p, m, i, rule="model"), count, paths)
+    print(f"{count} matches in {files} files")
+    print(f"  dataclass Match: {legacy / 2 ** 20:.1f} MiB")
+    print(f"  slotted Match:   {compact / 2 ** 20:.1f} MiB ({compact / legacy - 1:+.0%})")
+
+
+if __name__ == "__main__":
+    compare()
@@ -0,0 +1,118 @@
+import bz2
+import gzip
+import io
+import lzma
+import tarfile
+import zipfile
+from pathlib import PurePosixPath
+from typing import BinaryIO, Callable, Iterator
+
+import click
+
+from finney.domain_objects import ArchiveLimits
+
+zip_suffixes = {".zip", ".jar", ".war", ".ear", ".whl", ".egg", ".apk", ".nupkg"}
+tar_suffixes = {".tar", ".tgz", ".tbz", ".tbz2", ".txz"}
+compressed_suffixes = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+archive_errors = (zipfile.BadZipFile, tarfile.TarError, lzma.LZMAError, EOFError, OSError)
+
+OnSkip = Callable[[str, str], None]  # gets the name of what wasn't read, and why
+
+
+def _warn(name: str, reason: str) -> None:
+    click.echo(f"Warning: {name} {reason}", err=True)
+
+
+def _kind(name: str) -> str:
+    suffixes = [s.lower() for s in PurePosixPath(name).suffixes]
+    if not suffixes:
+        return ""
+    if suffixes[-1] in zip_suffixes:
+        return "zip"
+    if suffixes[-1] in tar_suffixes or (len(suffixes) > 1 and suffixes[-2] == ".tar"):
+        return "tar"
+    if suffixes[-1] in compressed_suffixes:
+        return "compressed"
+    return ""
+
+
+def is_archive(name) -> bool:
+    return bool(_kind(str(name)))
+
+
+class _Budget:
+    def __init__(self, limits: ArchiveLimits, on_skip: OnSkip = _warn):
+        self.limits = limits
+        self.remaining = limits.max_total_size
+        self.on_skip = on_skip
+
+    def read(self, name: str, stream: BinaryIO, declared_size: int = 0):
+        limit = min(self.limits.max_member_size, self.remaining)
+        if declared_size > limit:
+            self.on_skip(name, f"wasn't scanned, as its {declared_size} bytes are over the archive size limits")
+            return None
+        data = stream.read(limit + 1)  # declared sizes can lie, so never trust them alone
+        if len(data) > limit:
+            self.on_skip(name, "wasn't scanned, as it's over the archive size limits")
+            return None
+        self.remaining -= len(data)
+        return data
+
+
+def _members(name: str, fileobj: BinaryIO) -> Iterator[tuple[str, BinaryIO, int]]:
+    kind = _kind(name)
+    if kind == "zip":
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as member:
+                        yield info.filename, member, info.file_size
+    elif kind == "tar":
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:  # streaming mode, no seeking back
+            for info in archive:
+                if info.isfile():
+                    yield info.name, archive.extractfile(info), info.size
+    elif kind == "compressed":
+        opener = compressed_suffixes[PurePosixPath(name).suffix.lower()]
+        with opener(fileobj) as member:
+            yield PurePosixPath(name).stem, member, 0
+
+
+def iter_members(
+        name: str,
+        fileobj: BinaryIO,
+        limits: ArchiveLimits = ArchiveLimits(),
+        depth: int = 0,
+        budget=None,
+        on_skip: OnSkip = _warn,
+) -> Iterator[tuple[str, bytes]]:
+    """Stream (member name, contents) pairs out of an archive without extracting it to disk.
+
+    Nested archives are opened in memory up to `limits.max_depth`. Member names are
+    reported as `outer.zip!inner.jar!path/in/inner.txt`. Members that are over the limits, and
+    archives that can't be read (through), are passed to `on_skip` with the reason.
+    """
+    budget = budget or _Budget(limits, on_skip)
+    try:
+        for member_name, stream, size in _members(name, fileobj):
+            full_name = f"{name}!{member_name}"
+            data = budget.read(full_name, stream, size)
+            if data is None:
+                continue
+            if is_archive(member_name):
+                if depth + 1 > limits.max_depth:
+                    on_skip(full_name, f"wasn't scanned, as it's nested over {limits.max_depth} archives deep")
+                    continue
+                yield from iter_members(full_name, io.BytesIO(data), limits, depth + 1, budget, on_skip)
+            else:
+                yield full_name, data
+    except archive_errors as e:
+        on_skip(name, f"couldn't be read through: {type(e).__name__}: {e}")
+
+
+def iter_archive(
+        path, limits: ArchiveLimits = ArchiveLimits(), on_skip: OnSkip = _warn
+) -> Iterator[tuple[str, bytes]]:
+    with open(path, "rb") as f:
+        yield from iter_members(str(path), f, limits, on_skip=on_skip)
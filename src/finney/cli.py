@@ -1,6 +1,8 @@
 import os
 import pickle
+import sys
 from collections import defaultdict
+from datetime import datetime
 from enum import Enum
 from pathlib import Path
 from typing import Sequence
@@ -9,17 +11,25 @@ import click
 from rich.console import Console
 from rich.table import Table
 from rich import box
+from rich.markup import escape
 import yaml
 
-from finney import search
-from finney.domain_objects import Match, IgnoreConfig
+from finney import history, shards, watch as watching
+from finney.scanner import Scanner
+from finney.domain_objects import (
+    ArchiveLimits, EarlyExit, EntropyThresholds, FileLimits, Match, IgnoreConfig, PartialScan, ReadAhead, RuleConfig
+)
+from finney.models import intrinsic
 
 root = ".finney"
 config_path = f"{root}/config"
 last_matches_path = f"{root}/matches"
+scores_path = f"{root}/scores.json"
 
-if not os.path.exists(root):
-    os.mkdir(root)
+
+def _ensure_root() -> None:
+    if not os.path.exists(root):
+        os.mkdir(root)
 
 
 class ENTRY_TYPE(Enum):
@@ -43,14 +53,16 @@ def _get_recursive_paths(paths: list[str]) -> list[str]:
     return files
 
 
-def _load_ignore_config() -> IgnoreConfig:
+def _load_config() -> dict:
     if not os.path.exists(config_path):
-        return IgnoreConfig(dirs=[], files=[], types=[], strings=[])
+        return {}
 
     with open(config_path, "r") as f:
-        config = yaml.safe_load(f) or {}
+        return yaml.safe_load(f) or {}
 
-    config = config.get("ignore", {})
+
+def _load_ignore_config() -> IgnoreConfig:
+    config = _load_config().get("ignore") or {}
     return IgnoreConfig(
         dirs=config.get("dirs") or [],
         files=config.get("files") or [],
@@ -59,6 +71,88 @@ def _load_ignore_config() -> IgnoreConfig:
     )
 
 
+def _load_archive_limits() -> ArchiveLimits:
+    return ArchiveLimits(**(_load_config().get("archives") or {}))
+
+
+def _load_entropy_thresholds() -> EntropyThresholds:
+    return EntropyThresholds(**(_load_config().get("entropy") or {}))
+
+
+def _load_read_ahead() -> ReadAhead:
+    return ReadAhead(**(_load_config().get("read_ahead") or {}))
+
+
+def _load_early_exit() -> EarlyExit:
+    return EarlyExit(**(_load_config().get("early_exit") or {}))
+
+
+def _load_rules() -> intrinsic.RuleSet:
+    config = RuleConfig(**(_load_config().get("rules") or {}))
+    try:
+        return intrinsic.RuleSet(config)
+    except (ValueError, OSError) as e:
+        raise click.ClickException(f"Couldn't load the rules: {e}")
+
+
+def _load_file_limits() -> FileLimits:
+    return FileLimits(**(_load_config().get("limits") or {}))
+
+
+def _load_scanner() -> Scanner:
+    return Scanner(
+        _load_ignore_config(),
+        entropy_thresholds=_load_entropy_thresholds(),
+        archive_limits=_load_archive_limits(),
+        read_ahead=_load_read_ahead(),
+        early_exit=_load_early_exit(),
+        rules=_load_rules(),
+        file_limits=_load_file_limits(),
+    )
+
+
+def _load_score_cache(scanner: Scanner) -> bool:
+    """Size the scanner's score cache from the config, and fill it from disk if persisting is enabled."""
+    config = _load_config().get("cache") or {}
+    scanner.score_cache.maxsize = config.get("size", scanner.score_cache.maxsize)
+    persist = bool(config.get("persist"))
+    if persist:
+        scanner.score_cache.load(scores_path, scanner.model_version)
+    return persist
+
+
+def _save_score_cache(scanner: Scanner) -> None:
+    _ensure_root()
+    scanner.score_cache.save(scores_path, scanner.model_version)
+
+
+def _print_stats(scanner: Scanner) -> None:
+    stats = scanner.score_cache.stats()
+    print(
+        f"Score cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_rate']:.1%} hit rate), {stats['size']} entries"
+    )
+    if scanner.staged is not None:
+        stats = scanner.staged.stats()
+        stages = ", ".join(f"{count} after {fraction:.0%}" for fraction, count in stats["exits"].items())
+        print(
+            f"Early exit: {stats['exit_rate']:.1%} of {stats['candidates']} scored candidates "
+            f"decided before the last tree ({stages} of the trees)"
+        )
+    _print_rule_stats(scanner.rules)
+
+
+def _print_rule_stats(rules: intrinsic.RuleSet) -> None:
+    table = Table(box=box.MINIMAL)
+    table.add_column("Rule", justify="left")
+    table.add_column("Matches", justify="right")
+    table.add_column("Time (ms)", justify="right")
+    table.add_column("Skipped", justify="right")
+    for rule_id, counter in sorted(rules.stats().items(), key=lambda item: -item[1]["seconds"]):
+        table.add_row(rule_id, str(counter["matches"]), f"{counter['seconds'] * 1000:.1f}", str(counter["skipped"]))
+    Console().print(table)
+
+
 def _edit_ignore_entries(
         entry_type: ENTRY_TYPE, mode: MODE, values: Sequence[str]
 ) -> None:
@@ -83,9 +177,12 @@ def _edit_ignore_entries(
     combined = (
         prev_config + added_config if mode == MODE.ADD else prev_config - added_config
     )
+    config = _load_config()
+    config["ignore"] = combined.to_dict()
+    _ensure_root()
     with open(config_path, "w+") as f:
         yaml.safe_dump(
-            {"ignore": combined.to_dict()},
+            config,
             f,
             indent=4,
             default_flow_style=False,
@@ -121,6 +218,7 @@ def _select_entry_type(
 
 
 def _save_last_matches(matches: Sequence[Match]) -> None:
+    _ensure_root()
     with open(last_matches_path, "wb+") as f:
         pickle.dump(matches, f)
 
@@ -181,20 +279,158 @@ If they aren't, you can mark them as safe in the following ways:
     # finney: ignore""")
 
 
-@cli.command(help="Run Finney on the given files")
+@cli.command(help="Run Finney on the given files, or on stdin if the only path is -")
 @click.argument("paths", nargs=-1)
 @click.option("-r", "recursive", is_flag=True, default=False, help="Recursively search the given paths")
-def run(paths, recursive):
-    ignored = _load_ignore_config()
-    if recursive:
-        paths = _get_recursive_paths(paths)
-    matches: Sequence[Match] = search.scan_files(paths, ignored)
+@click.option("--stats", "show_stats", is_flag=True, default=False, help="Print score cache, early exit and per-rule statistics")
+@click.option("--shard", "shard", default=None, metavar="I/N",
+              help="Only scan shard I of N (1-based), and write the results for `finney merge` instead of reporting")
+@click.option("-o", "--output", "output", default=None, help="Where to write the shard's results")
+def run(paths, recursive, show_stats, shard, output):
+    scanner = _load_scanner()
+    partial: list[PartialScan] = []
+    persist_cache = _load_score_cache(scanner)
+    if shard and paths == ("-",):
+        raise click.UsageError("--shard can't be used when scanning stdin")
+    if paths == ("-",):
+        chunks = iter(lambda: sys.stdin.buffer.read(1 << 16), b"")
+        matches: Sequence[Match] = scanner.scan_stream(chunks, report=partial)
+    else:
+        roots = paths if recursive else ()
+        if recursive:
+            paths = _get_recursive_paths(paths)
+        if shard:
+            index, count = shards.parse_shard(shard)
+            paths = shards.select(paths, index, count, roots)
+        matches = scanner.scan_files(paths, show_progress=True, report=partial)
+    if persist_cache:
+        _save_score_cache(scanner)
+    if show_stats:
+        _print_stats(scanner)
+
+    if shard:
+        if not output:
+            _ensure_root()
+            output = f"{root}/shard-{index}-of-{count}.json"
+        shards.write_partial(output, index, count, len(paths), matches, partial)
+        _print_partial(partial)
+        print(f"Shard {index}/{count}: scanned {len(paths)} files, found {len(matches)} suspected secrets. "
+              f"Results written to {output}")
+        return
 
     if matches:
         _pretty_print(matches)
         _save_last_matches(matches)
+        _print_partial(partial)
         exit(1)
     print("Finney didn't find any suspected secrets :D")
+    _print_partial(partial)
+
+
+def _print_partial(partial: Sequence[PartialScan]) -> None:
+    if not partial:
+        return
+    files = {p.path for p in partial}
+    click.secho(
+        f"\nPartially scanned {len(files)} {'files' if len(files) > 1 else 'file'}, "
+        f"which may hide secrets Finney didn't get to:", fg="yellow"
+    )
+    for p in partial:
+        print(f"- {p.path} {p.reason}")
+    print("The limits on what's scanned can be raised in the limits and archives sections of .finney/config")
+
+
+def _pretty_print_audit(matches: Sequence[Match]) -> None:
+    findings_by_path = defaultdict(lambda: defaultdict(list))
+    for m in matches:
+        findings_by_path[str(m.path)][(m.line, m.match)].append(m.commit[:8])
+    count = sum(len(findings) for findings in findings_by_path.values())
+    click.secho(
+        f"Found {count} suspected {'secrets' if count > 1 else 'secret'} "
+        f"in {len(findings_by_path)} {'files' if len(findings_by_path) > 1 else 'file'} across the audited history:\n"
+    )
+    console = Console()
+    for path, findings in sorted(findings_by_path.items()):
+        print(f"In file: {path}")
+        table = Table(box=box.MINIMAL)
+        table.add_column("Line", justify="right")
+        table.add_column("Suspected Secret", justify="left")
+        table.add_column("Commits", justify="left")
+        for (line, match), commits in sorted(findings.items()):
+            commits = sorted(commits)
+            shown = ", ".join(commits[:3]) + (f" (+{len(commits) - 3} more)" if len(commits) > 3 else "")
+            table.add_row(str(line), match, shown)
+        console.print(table)
+        print()
+
+
+@cli.command(help="Combine the results of sharded runs (`finney run --shard`) into one report")
+@click.argument("results", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--allow-missing", "allow_missing", is_flag=True, default=False,
+              help="Report the shards that were given even if some are missing, instead of failing")
+def merge(results, allow_missing):
+    matches, files, missing, partial = shards.merge(results)
+    if missing and not allow_missing:
+        raise click.UsageError(
+            f"No results for shards {', '.join(map(str, missing))}, so the report wouldn't cover every file. "
+            f"Pass --allow-missing to merge the given shards anyway"
+        )
+    if missing:
+        click.secho(f"Warning: no results for shards {', '.join(map(str, missing))}, "
+                    f"so the report doesn't cover every file\n", fg="yellow", err=True)
+
+    if matches:
+        _pretty_print(matches)
+        _save_last_matches(matches)
+        _print_partial(partial)
+        exit(1)
+    print(f"Finney didn't find any suspected secrets in {files} files :D")
+    _print_partial(partial)
+
+
+@cli.command(help="Audit a git repository, including every version of every file in its history")
+@click.argument("repo", default=".")
+@click.option("--history", "full_history", is_flag=True, default=False,
+              help="Scan every unique blob in the history of all refs, not just HEAD")
+@click.option("-j", "workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+def audit(repo, full_history, workers):
+    partial: list[PartialScan] = []
+    matches: Sequence[Match] = history.audit(
+        repo, _load_scanner(), history=full_history, workers=workers, report=partial
+    )
+
+    if matches:
+        _pretty_print_audit(matches)
+        _save_last_matches(matches)
+        _print_partial(partial)
+        exit(1)
+    print("Finney didn't find any suspected secrets :D")
+    _print_partial(partial)
+
+
+def _print_changes(new: list[Match], resolved: list[Match], findings: dict[str, set[Match]]) -> None:
+    stamp = datetime.now().strftime("%H:%M:%S")
+    for m in sorted(new, key=lambda m: (str(m.path), m.line)):
+        click.secho(f"[{stamp}] + {m.path}:{m.line}  {m.match}", fg="red")
+    for m in sorted(resolved, key=lambda m: (str(m.path), m.line)):
+        click.secho(f"[{stamp}] - {m.path}:{m.line}  {m.match}", fg="green")
+    count = sum(len(found) for found in findings.values())
+    print(f"[{stamp}] {count} suspected {'secret' if count == 1 else 'secrets'} in {len(findings)} "
+          f"{'file' if len(findings) == 1 else 'files'}")
+
+
+@cli.command(help="Scan the given files, then rescan them whenever they change, until interrupted")
+@click.argument("paths", nargs=-1, required=True)
+@click.option("-r", "recursive", is_flag=True, default=False, help="Recursively watch the given directories")
+@click.option("--debounce", "debounce", type=float, default=0.3, show_default=True,
+              help="Seconds to wait for a burst of changes to settle before rescanning")
+def watch(paths, recursive, debounce):
+    scanner = _load_scanner()
+    print("Watching for changes, press Ctrl+C to stop")
+    findings = watching.watch(list(paths), scanner, recursive, debounce, on_change=_print_changes)
+    matches = [m for found in findings.values() for m in found]
+    if matches:
+        _save_last_matches(matches)
 
 
 @cli.command("ignore", help="Defined values that can be safely ignored")
@@ -219,6 +455,20 @@ def unignore(strings, files, dirs, types, values):
     _edit_ignore_entries(entry_type, mode=MODE.SUBTRACT, values=list(values))
 
 
+@cli.command("rules", help="List the rules Finney matches, and where each one comes from")
+def _rules():
+    rules = _load_rules()
+    table = Table(box=box.MINIMAL)
+    table.add_column("Rule", justify="left")
+    table.add_column("Source", justify="left")
+    table.add_column("Pattern", justify="left")
+    for rule_id, regex in rules.rules.items():
+        table.add_row(rule_id, rules.sources[rule_id], escape(regex.pattern))
+    for rule_id in sorted(rules.disabled & rules.sources.keys()):
+        table.add_row(rule_id, rules.sources[rule_id], "(disabled)")
+    Console().print(table)
+
+
 @cli.command("list", help="Print the current ignore configuration")
 def _list():
     config = _load_ignore_config()
@@ -1,21 +1,48 @@
-from dataclasses import dataclass
+import sys
+from dataclasses import dataclass, field
+from functools import lru_cache
 from hashlib import sha256
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Union
 
 
 def _sub(l1, l2):
     return [x for x in l1 if x not in l2]
 
 
-@dataclass
+@lru_cache(maxsize=1 << 16)
+def _shared_path(path: str) -> Path:
+    return Path(path)
+
+
 class Match:
-    path: Path
-    match: str
-    line: int = 0
+    """A single finding.
+
+    Audits can produce hundreds of thousands of these, so they're kept compact: no per-instance dict
+    and nothing cached per instance. The path is stored as an interned string shared by every match in
+    the same file, and turned into a `Path` that's shared too.
+    """
+
+    __slots__ = ("_path", "match", "line", "commit", "rule")
+
+    def __init__(self, path: Union[Path, str], match: str, line: int = 0, commit: str = "", rule: str = ""):
+        self._path = sys.intern(str(path))
+        self.match = match
+        self.line = line
+        self.commit = commit
+        self.rule = rule  # which detector found it, e.g. "intrinsic:aws-access-key-id", "entropy" or "model"
+
+    @property
+    def path(self) -> Path:
+        return _shared_path(self._path)
 
     def __str__(self):
-        return f"{self.path}:{self.line:0>3}: '{self.match}'"
+        if self.commit:
+            return f"{self.commit[:8]}:{self._path}:{self.line:0>3}: '{self.match}'"
+        return f"{self._path}:{self.line:0>3}: '{self.match}'"
+
+    def __repr__(self):
+        return f"Match(path={self._path!r}, match={self.match!r}, line={self.line}, commit={self.commit!r}, rule={self.rule!r})"
 
     @property
     def sha(self):
@@ -32,10 +59,28 @@ class Match:
         return "." * (length - len(str(self.match))) + " '" + self.match + "'"
 
     def __eq__(self, other):
-        return self.path == other.path and self.match == other.match
+        if not isinstance(other, Match):
+            return NotImplemented
+        return self._path == other._path and self.match == other.match and self.commit == other.commit
 
     def __hash__(self):
-        return hash(self.path.name + self.match)
+        return hash((self._path, self.match, self.commit))  # cheap, as strings cache their own hashes
+
+    def to_dict(self) -> dict:
+        return {"path": self._path, "match": self.match, "line": self.line, "commit": self.commit, "rule": self.rule}
+
+    @staticmethod
+    def from_dict(d: dict) -> "Match":
+        return Match(d["path"], d["match"], d.get("line", 0), d.get("commit", ""), d.get("rule", ""))
+
+    def __reduce__(self):
+        return Match, (self._path, self.match, self.line, self.commit, self.rule)
+
+    def __setstate__(self, state):
+        # matches pickled before Match had slots were plain dataclasses
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        self.__init__(state["path"], state["match"], state.get("line", 0), state.get("commit", ""), state.get("rule", ""))
 
 
 @dataclass
@@ -90,4 +135,63 @@ class IgnoreConfig:
         if self.strings:
             print("Strings:")
             for s in self.strings:
-                print(f" - {s}")
\ No newline at end of file
+                print(f" - {s}")
+
+@dataclass
+class ArchiveLimits:
+    max_member_size: int = 16 * 1024 * 1024  # bytes, larger members are skipped
+    max_total_size: int = 256 * 1024 * 1024  # bytes decompressed from a single top-level archive
+    max_depth: int = 3  # archives nested deeper than this aren't opened
+
+
+@dataclass
+class EntropyThresholds:
+    min_length: int = 20
+    max_length: int = 512  # longer tokens are usually embedded data (images, certificates bundles...)
+    # minimum Shannon entropy (bits per character) for each charset, None disables it. Hex is off by
+    # default, as git and file hashes are just as random as hex secrets
+    hex: Optional[float] = None
+    base64: Optional[float] = 4.8
+    base64url: Optional[float] = 4.8
+    other: Optional[float] = 4.8
+    # minimum entropy for a candidate to be scored by the model, None scores everything
+    gate: Optional[float] = None
+
+
+@dataclass
+class ReadAhead:
+    max_bytes: int = 64 * 1024 * 1024  # max bytes read ahead of the file being scanned
+    workers: int = 4  # threads reading files in the background
+
+
+@dataclass
+class EarlyExit:
+    enabled: bool = False
+    # fractions of the model's trees after which candidates that can't be flagged anymore stop being scored
+    stages: List[float] = field(default_factory=lambda: [0.1, 0.25, 0.5])
+
+
+@dataclass
+class RuleConfig:
+    custom: Dict[str, str] = field(default_factory=dict)  # more rules, as id: pattern
+    packs: List[str] = field(default_factory=list)  # yaml files of more rules
+    disabled: List[str] = field(default_factory=list)  # ids of rules that won't run
+    time_budget: Optional[float] = 1.0  # seconds of rule matching per file, None for no limit
+
+
+@dataclass
+class FileLimits:
+    # files longer than this many characters are only matched against the rules
+    max_size: int = 4 * 1024 * 1024
+    # files with more candidates than this have an evenly spaced sample of them scored by the model
+    max_candidates: int = 20_000
+    # seconds, after which the model stops scoring a file's remaining candidates
+    max_seconds: float = 10.0
+    # candidates whose features are computed and scored at once, max_seconds is checked between batches
+    batch_size: int = 1000
+
+
+@dataclass
+class PartialScan:
+    path: str
+    reason: str
@@ -0,0 +1,158 @@
+import subprocess
+import threading
+from collections import defaultdict
+from pathlib import Path, PurePosixPath
+from typing import Iterable, Iterator, Optional
+
+import click
+
+from finney.domain_objects import Match, PartialScan
+from finney.scanner import Scanner, decode
+
+def _git(repo: str, *args: str) -> list[str]:
+    return ["git", "-C", repo, *args]
+
+
+def _is_sha(token: str) -> bool:
+    return len(token) in (40, 64) and all(c in "0123456789abcdef" for c in token)
+
+
+def _split_stream(stream, sep: bytes = b"\0", chunk_size: int = 1 << 20) -> Iterator[str]:
+    rest = b""
+    while chunk := stream.read(chunk_size):
+        *tokens, rest = (rest + chunk).split(sep)
+        for token in tokens:
+            yield token.decode("utf-8", errors="surrogateescape")
+    if rest:
+        yield rest.decode("utf-8", errors="surrogateescape")
+
+
+def history_blobs(repo: str) -> dict[str, set[tuple[str, str]]]:
+    """Map every blob sha in the repo's history to the (commit, path) pairs that introduced it.
+
+    Merges are diffed against each of their parents (`-m`), since by default `git log` shows no diff
+    for them, and blobs that first appear in a merge (conflict resolutions, evil merges) would be missed.
+    Only what a merge adds compared to all of its parents is attributed to it, and not whatever it
+    brings in from the merged branches.
+    """
+    blobs = defaultdict(set)
+    cmd = _git(repo, "log", "--all", "-m", "--raw", "--no-abbrev", "--no-renames", "--no-color", "-z", "--format=%H")
+
+    def add(commit: Optional[str], sections: list[set[tuple[str, str]]]) -> None:
+        # a merge's header is repeated before its diff against each parent
+        for sha, path in set.intersection(*sections) if sections else ():
+            blobs[sha].add((commit, path))
+
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        commit = None
+        sections = []
+        tokens = _split_stream(proc.stdout)
+        for token in tokens:
+            token = token.lstrip("\n")
+            if token.startswith(":"):
+                path = next(tokens)
+                _, new_mode, _, new_sha, _ = token[1:].split(" ")
+                if new_sha.strip("0") and not new_mode.startswith("160"):  # skip deletions and submodules
+                    sections[-1].add((new_sha, path))
+            elif _is_sha(token):
+                if token != commit:
+                    add(commit, sections)
+                    commit, sections = token, []
+                sections.append(set())
+        add(commit, sections)
+    if proc.returncode:
+        raise click.ClickException(f"Failed to read the history of {repo}")
+    return blobs
+
+
+def head_blobs(repo: str) -> dict[str, set[tuple[str, str]]]:
+    """Map every blob in the tree of HEAD to its path."""
+    commit = subprocess.run(_git(repo, "rev-parse", "HEAD"), capture_output=True, text=True, check=True).stdout.strip()
+    listing = subprocess.run(_git(repo, "ls-tree", "-r", "-z", "HEAD"), capture_output=True, check=True).stdout
+    blobs = defaultdict(set)
+    for entry in listing.decode("utf-8", errors="surrogateescape").split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", 1)
+        _, obj_type, sha = info.split(" ")
+        if obj_type == "blob":
+            blobs[sha].add((commit, path))
+    return blobs
+
+
+def read_blobs(repo: str, shas: Iterable[str]) -> Iterator[tuple[str, bytes]]:
+    """Stream the contents of the given blobs through a single `git cat-file --batch` process."""
+    proc = subprocess.Popen(_git(repo, "cat-file", "--batch"), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def feed():
+        try:
+            for sha in shas:
+                proc.stdin.write(f"{sha}\n".encode())
+            proc.stdin.close()
+        except BrokenPipeError:  # the reader stopped early
+            pass
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    try:
+        while header := proc.stdout.readline():
+            sha, obj_type, *rest = header.decode().split()
+            if obj_type == "missing":
+                continue
+            data = proc.stdout.read(int(rest[0]))
+            proc.stdout.read(1)  # trailing newline
+            yield sha, data
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+        writer.join()
+
+
+def audit(
+        repo: str,
+        scanner: Scanner,
+        history: bool = True,
+        workers: Optional[int] = None,
+        report: Optional[list[PartialScan]] = None,
+) -> list[Match]:
+    blobs = history_blobs(repo) if history else head_blobs(repo)
+
+    # a blob is scanned once if any of the paths it appears under isn't ignored,
+    # and its findings are only attributed to those paths
+    refs = {}
+    for sha, pairs in blobs.items():
+        pairs = {(commit, path) for commit, path in pairs if scanner.should_scan(path)}
+        if pairs:
+            refs[sha] = pairs
+
+    matches = []
+    hide_bar = len(refs) < 10
+    with click.progressbar(length=len(refs), label="Scanning blobs", hidden=hide_bar, show_pos=True) as bar:
+        notes = []
+
+        def items():
+            for sha, data in read_blobs(repo, refs):
+                # keep one of the blob's file names, so it's scanned according to its file type
+                _, path = next(iter(refs[sha]))
+                name = Path(sha, PurePosixPath(path).name)
+                text = decode(data, name, notes)
+                if text is None:
+                    bar.update(1)
+                    continue
+                yield name, text
+
+        for found in scanner.scan_texts_parallel(items(), workers, notes):
+            bar.update(1)
+            for m in found:
+                for commit, path in refs[m.path.parent.name]:
+                    matches.append(Match(path, m.match, m.line, commit, m.rule))
+
+    # notes about a blob are reported once, under one of its paths
+    for note in notes:
+        commit, path = min(refs[Path(note.path).parent.name])
+        if report is not None:
+            report.append(PartialScan(f"{path} ({commit[:8]})", note.reason))
+        else:
+            click.echo(f"Warning: {path} ({commit[:8]}) {note.reason}", err=True)
+    return matches
@@ -1,32 +1,47 @@
 import dataclasses
+import hashlib
+import json
+import os
 import pickle
 import re
+import threading
 import time
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
 from itertools import combinations_with_replacement
-from typing import Self
+from pathlib import Path
+from typing import Any, NamedTuple, Optional, Self, Sequence
 
 import numpy as np
 import pandas as pd
 
-from finney.models.features import get_features
+from finney.models import extractors
+from finney.models.entropy import shannon_entropy
+from finney.models.features import Dictionaries, data_dir, get_features, legacy_features
 
-candidate_pattern = r"""(["'`])[a-zA-Z0-9&*!?.\-_#%@^&$"'`{} ()\[\]]{6,30}\1"""
+candidate_pattern = re.compile(r"[\x20-\x7e]+")  # printable ascii
+min_candidate_length = 6
+max_candidate_length = 64
 
 
 def extract_candidates_from_file(path) -> pd.DataFrame:
     with open(path, "r") as f:
-        candidates = []
-        for line in f.readlines():
-            if match := re.search(candidate_pattern, line):
-                candidates.append(match.group()[1:-1])
-    return pd.DataFrame(candidates, columns=["text"])
+        return extract_candidates(f.read(), Path(path))
+
+
+def extract_candidates(text: str, path: Optional[Path] = None) -> pd.DataFrame:
+    candidates = [
+        literal for literal in extractors.extract(text, extractors.language_of(path))
+        if min_candidate_length <= len(literal.text) <= max_candidate_length
+        and candidate_pattern.fullmatch(literal.text)
+    ]
+    return pd.DataFrame(candidates, columns=["text", "start"])
 
 
 alphabet = list("abcdefghijklmnopqrstuvwxyz")
 short_words = alphabet + ["".join(x) for x in combinations_with_replacement(alphabet, 2)]
 
-snippet_words_df = list(pd.read_csv("src/finney/data/context_words.csv"))
 
 
 @dataclasses.dataclass
@@ -127,9 +142,8 @@ def make_tree(word_features: pd.DataFrame, samples: int, eta: float, max_depth:
     # print(f"  {f1}")
 
     if save:
-        with open("src/finney/models/tree.pkl", "wb") as f:
-            pickle.dump(clf, f)
-            time.sleep(0.5)
+        save_model(clf, list(word_features.columns), model_path, test_f1=test_f1)
+        time.sleep(0.5)
 
     # df = pd.DataFrame(texts_test)
     # df["y_true"] = y_test
@@ -139,12 +153,187 @@ def make_tree(word_features: pd.DataFrame, samples: int, eta: float, max_depth:
     return score
 
 
-def predict(words):
-    with open("src/finney/models/tree.pkl", "rb") as f:
-        tree = pickle.load(f)
+model_path = str(Path(__file__).parent / "tree.pkl")
+
+
+class Model(NamedTuple):
+    model: Any
+    version: str  # identifies the pickled model's contents
+    features: tuple[str, ...]  # the names of the feature columns the model expects, in order
+
+
+def save_model(model, features: Sequence[str], path: str = model_path, **metadata) -> None:
+    """Pickle a trained model along with the feature set it was trained on, and any other metadata."""
+    with open(path, "wb") as f:
+        pickle.dump({"model": model, "features": list(features), **metadata}, f)
+
+
+@lru_cache(maxsize=None)
+def load_model(path: str = model_path) -> Model:
+    """Load a pickled model once. Models pickled bare, without metadata, use the legacy feature set."""
+    with open(path, "rb") as f:
+        data = f.read()
+    loaded = pickle.loads(data)
+    version = hashlib.sha256(data).hexdigest()[:16]
+    if isinstance(loaded, dict):
+        return Model(loaded["model"], version, tuple(loaded["features"]))
+    return Model(loaded, version, legacy_features)
+
+
+class ScoreCache:
+    """Bounded LRU cache of model verdicts, keyed by model version, threshold and candidate text.
+
+    Shared by every file in a scan, so that each unique string is scored once per model.
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, float, str]) -> Optional[bool]:
+        with self._lock:
+            verdict = self._entries.get(key)
+            if verdict is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return verdict
+
+    def put(self, key: tuple[str, float, str], verdict: bool) -> None:
+        with self._lock:
+            self._entries[key] = verdict
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+    def save(self, path: str, model_version: str) -> None:
+        with self._lock:
+            entries = [[*k, v] for k, v in self._entries.items() if k[0] == model_version]
+        with open(path, "w+") as f:
+            json.dump(entries[-self.maxsize:], f)
+
+    def load(self, path: str, model_version: str) -> None:
+        """Load entries persisted by an earlier run, dropping any computed by a different model.
+
+        The file lives in the repository, so it's plain JSON (never unpickled), and anything
+        malformed in it is ignored.
+        """
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(entries, list):
+            return
+        with self._lock:
+            for entry in entries:
+                if not (isinstance(entry, list) and len(entry) == 4):
+                    continue
+                version, threshold, text, verdict = entry
+                if (version == model_version and isinstance(threshold, (int, float))
+                        and isinstance(text, str) and isinstance(verdict, bool)):
+                    self._entries[(version, float(threshold), text)] = verdict
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+score_cache = ScoreCache()
+
+
+class StagedModel:
+    """Runs the model's trees a stage at a time, and stops early for candidates that can't be flagged anymore.
+
+    A candidate is flagged only if the probability of class 0 (not a secret) ends up below the threshold.
+    After each stage, the smallest and largest leaf of every remaining tree bound how far the margins can
+    still move; candidates whose class 0 probability stays above the threshold even in the worst case are
+    decided then. The rest are scored with the full model, so the verdicts are exactly those of `predict`.
+    """
+
+    def __init__(self, model, stages: Sequence[float] = (0.1, 0.25, 0.5)):
+        self.model = model
+        self.booster = model.get_booster()
+        rounds = self.booster.num_boosted_rounds()
+        self.stages = sorted({min(max(1, round(rounds * s)), rounds) for s in stages} - {rounds})
+
+        leaves = self.booster.trees_to_dataframe()
+        leaves = leaves[leaves["Feature"] == "Leaf"].groupby("Tree")["Gain"]
+        groups = (leaves.ngroups // rounds) or 1  # one tree per class per round, or one per round if binary
+        low = leaves.min().to_numpy().reshape(rounds, groups)
+        high = leaves.max().to_numpy().reshape(rounds, groups)
+        # what the trees from each round onwards can add to the margins, at least and at most
+        self.remaining_low = np.cumsum(low[::-1], axis=0)[::-1]
+        self.remaining_high = np.cumsum(high[::-1], axis=0)[::-1]
+
+        self.candidates = 0
+        self.exits = [0] * len(self.stages)
+        self._lock = threading.Lock()
+
+    def _min_benign_probability(self, margin: np.ndarray, end: int) -> np.ndarray:
+        low = margin + self.remaining_low[end]
+        high = margin + self.remaining_high[end]
+        if margin.shape[1] == 1:  # binary:logistic, the margin is the logit of class 1
+            return 1 / (1 + np.exp(high[:, 0]))
+        worst = np.concatenate([low[:, :1], high[:, 1:]], axis=1)
+        return np.exp(worst[:, 0] - np.logaddexp.reduce(worst, axis=1))
+
+    def flagged(self, word_features: pd.DataFrame, threshold: float) -> list[int]:
+        """Return the indices of the flagged rows, same as `clean_results(predict(...), threshold)`."""
+        alive = np.arange(len(word_features))
+        margin = None
+        start = 0
+        exits = []
+        for end in self.stages:
+            if not len(alive):
+                break
+            margin = self.booster.inplace_predict(
+                word_features.iloc[alive], iteration_range=(start, end), predict_type="margin", base_margin=margin
+            ).reshape(len(alive), -1)
+            decided = self._min_benign_probability(margin, end) >= threshold + 1e-6  # leeway for rounding
+            exits.append(int(decided.sum()))
+            alive, margin, start = alive[~decided], margin[~decided], end
+
+        flagged = []
+        if len(alive):
+            pred_weights = self.model.predict_proba(word_features.iloc[alive])
+            flagged = alive[clean_results(pred_weights, threshold)].tolist()
+        with self._lock:
+            self.candidates += len(word_features)
+            for i, count in enumerate(exits):
+                self.exits[i] += count
+        return flagged
+
+    def stats(self) -> dict:
+        rounds = self.booster.num_boosted_rounds()
+        with self._lock:
+            return {
+                "candidates": self.candidates,
+                "exits": {end / rounds: count for end, count in zip(self.stages, self.exits)},
+                "exit_rate": sum(self.exits) / self.candidates if self.candidates else 0.0,
+            }
+
+
+def predict(words, model: Optional[Model] = None, dictionaries: Optional[Dictionaries] = None):
+    model = model if model is not None else load_model()
     words = pd.DataFrame(words)
-    word_features = get_features(words)
-    res = tree.predict_proba(word_features)
+    word_features = get_features(words, dictionaries, model.features)
+    res = model.model.predict_proba(word_features)
     return res
 
 
@@ -161,12 +350,68 @@ def scan(path, threshold=0.2):
     candidates = extract_candidates_from_file(path)
     # except:
     # return []
-    if not len(candidates.index):
+    return score_candidates(candidates["text"], threshold)
+
+
+def scan_text(
+        text: str,
+        threshold=0.2,
+        min_entropy=None,
+        path: Optional[Path] = None,
+        model: Optional[Model] = None,
+        cache: Optional["ScoreCache"] = None,
+        dictionaries: Optional[Dictionaries] = None,
+        staged: Optional[StagedModel] = None,
+):
+    return score_candidates(find_candidates(text, min_entropy, path), threshold, model, cache, dictionaries, staged)
+
+
+def find_candidates(text: str, min_entropy=None, path: Optional[Path] = None) -> list[str]:
+    """Return the unique candidates in the text that the model should score."""
+    candidates = extract_candidates(text, path)
+    if min_entropy is not None and len(candidates.index):
+        # cheap pre-filter, so that only candidates with some randomness to them get their features computed
+        entropies = shannon_entropy(candidates["text"].tolist())
+        candidates = candidates[entropies >= min_entropy].reset_index(drop=True)
+    return list(dict.fromkeys(candidates["text"]))
+
+
+def score_candidates(
+        candidates: Sequence[str],
+        threshold=0.2,
+        model: Optional[Model] = None,
+        cache: Optional[ScoreCache] = None,
+        dictionaries: Optional[Dictionaries] = None,
+        staged: Optional[StagedModel] = None,
+) -> list[str]:
+    """Return the unique candidates the model flags as secrets, scoring each at most once per model.
+
+    `model` is as returned by `load_model`, and defaults to the bundled model.
+    If `staged` (built over the same model) is given, candidates are scored with early exits.
+    """
+    if not len(candidates):
         return []
-    pred_weights = predict(candidates)
-    results = clean_results(pred_weights, threshold)
-
-    return [candidates.loc[i].text for i, guess in enumerate(results) if guess]
+    model = model if model is not None else load_model()
+    version = model.version
+    cache = cache if cache is not None else score_cache
+    texts = list(dict.fromkeys(candidates))
+    verdicts = {}
+    for text in texts:
+        verdicts[text] = cache.get((version, threshold, text))
+
+    unscored = [text for text, verdict in verdicts.items() if verdict is None]
+    if unscored:
+        if staged is not None:
+            word_features = get_features(pd.DataFrame(unscored, columns=["text"]), dictionaries, model.features)
+            results = set(staged.flagged(word_features, threshold))
+        else:
+            pred_weights = predict(pd.DataFrame(unscored, columns=["text"]), model, dictionaries)
+            results = set(clean_results(pred_weights, threshold))
+        for i, text in enumerate(unscored):
+            verdicts[text] = i in results
+            cache.put((version, threshold, text), i in results)
+
+    return [text for text in texts if verdicts[text]]
 
 
 if __name__ == "__main__":
@@ -187,6 +432,7 @@ if __name__ == "__main__":
         names=["text", "label"],
     ).dropna()
 
+    snippet_words_df = list(pd.read_csv(data_dir / "context_words.csv"))
     texts = df["text"].astype(str).tolist() + short_words + snippet_words_df
     labels = df["label"].astype(int).tolist() + [0 for _ in short_words] + [0 for _ in snippet_words_df]
     # labels = [y > 0 for y in labels]
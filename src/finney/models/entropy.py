@@ -0,0 +1,93 @@
+import re
+from typing import Sequence
+
+import numpy as np
+
+from ..domain_objects import EntropyThresholds, IgnoreConfig
+
+token_pattern = re.compile(r"[A-Za-z0-9+/=_\-.~]+")
+# checksums are as random as secrets but public: lockfile integrity values (sha512-...) and digests (sha256:...)
+digest_prefixes = tuple(f"{name}{sep}" for name in ("sha1", "sha224", "sha256", "sha384", "sha512") for sep in "-:")
+
+HEX, BASE64, BASE64URL, DIGIT, LETTER = 1, 2, 4, 8, 16
+charsets = ["hex", "base64", "base64url"]  # in order of precedence, anything else is "other"
+
+char_classes = np.zeros(256, dtype=np.uint8)
+for c in b"0123456789":
+    char_classes[c] |= HEX | BASE64 | BASE64URL | DIGIT
+for c in b"abcdefABCDEF":
+    char_classes[c] |= HEX
+for c in b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ":
+    char_classes[c] |= BASE64 | BASE64URL | LETTER
+for c in b"+/":
+    char_classes[c] |= BASE64
+for c in b"-_":
+    char_classes[c] |= BASE64URL
+for c in b"=":
+    char_classes[c] |= BASE64 | BASE64URL
+
+
+def _flatten(tokens: Sequence[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    encoded = [t.encode("utf-8") for t in tokens]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), lengths, offsets
+
+
+def _entropy(data: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    counts = np.bincount(rows * 256 + data, minlength=len(lengths) * 256).reshape(-1, 256)
+    p = counts / np.maximum(lengths, 1)[:, None]
+    logs = np.log2(p, out=np.zeros_like(p), where=p > 0)
+    return -(p * logs).sum(axis=1)
+
+
+def shannon_entropy(tokens: Sequence[str], batch_size: int = 4096) -> np.ndarray:
+    """Shannon entropy in bits per byte of each token, computed for whole batches at once."""
+    out = np.zeros(len(tokens))
+    for start in range(0, len(tokens), batch_size):
+        data, lengths, _ = _flatten(tokens[start:start + batch_size])
+        if len(data):
+            out[start:start + len(lengths)] = _entropy(data, lengths)
+    return out
+
+
+def detect(tokens: Sequence[str], thresholds: EntropyThresholds, batch_size: int = 4096) -> np.ndarray:
+    """Boolean mask of the tokens whose entropy is over the threshold of their charset.
+
+    A token's charset is the narrowest of hex, base64 and base64url that holds all its characters,
+    or "other". Tokens also need both letters and digits, as almost every generated secret does.
+    """
+    limits_by_charset = np.array([
+        np.inf if getattr(thresholds, name) is None else getattr(thresholds, name)
+        for name in charsets + ["other"]
+    ])
+    out = np.zeros(len(tokens), dtype=bool)
+    for start in range(0, len(tokens), batch_size):
+        data, lengths, offsets = _flatten(tokens[start:start + batch_size])
+        if not len(data):
+            continue
+        classes = char_classes[data]
+        common = np.bitwise_and.reduceat(classes, offsets)
+        present = np.bitwise_or.reduceat(classes, offsets)
+        charset = np.select([common & HEX > 0, common & BASE64 > 0, common & BASE64URL > 0], [0, 1, 2], default=3)
+        mixed = (present & DIGIT > 0) & (present & LETTER > 0)
+        out[start:start + len(lengths)] = (_entropy(data, lengths) >= limits_by_charset[charset]) & mixed
+    return out
+
+
+def _is_digest(data: str, mo: re.Match) -> bool:
+    return mo.group().startswith(digest_prefixes) or data.endswith(digest_prefixes, 0, mo.start())
+
+
+def extract_tokens(data: str, thresholds: EntropyThresholds) -> list[str]:
+    return [
+        mo.group() for mo in token_pattern.finditer(data)
+        if thresholds.min_length <= len(mo.group()) <= thresholds.max_length and not _is_digest(data, mo)
+    ]
+
+
+def scan_text(data: str, ignored: IgnoreConfig, thresholds: EntropyThresholds = EntropyThresholds()) -> list[str]:
+    tokens = list(dict.fromkeys(extract_tokens(data, thresholds)))
+    mask = detect(tokens, thresholds)
+    return [t for t, hit in zip(tokens, mask) if hit and t not in ignored.strings]
@@ -0,0 +1,80 @@
+import re
+from pathlib import PurePath
+from typing import Iterator, NamedTuple, Optional
+
+
+class Literal(NamedTuple):
+    text: str
+    start: int  # offset of the literal's contents in the scanned buffer
+
+
+# building blocks, each capturing the literal's contents in a uniquely named group
+double_quoted = r'"(?P<double>(?:\\.|[^"\\\n])*)"'
+single_quoted = r"'(?P<single>(?:\\.|[^'\\\n])*)'"
+triple_quoted = r'(?P<q3>"""|\'\'\')(?P<triple>(?s:.*?))(?P=q3)'
+template = r"`(?P<template>(?:\\.|[^`\\])*)`"
+json_key = r'"(?:\\.|[^"\\\n])*"[ \t]*:'  # matched only to be skipped over
+unquoted = r"[^\s'\"](?:[^\n]*?\S)?"  # runs until the end of the line or a " # comment"
+line_end = r"(?:[ \t]+[#;][^\n]*)?[ \t]*\r?$"  # CRLF files keep their \r before the \n
+env_assignment = (
+    r"^[ \t]*(?:export[ \t]+)?[A-Za-z_][\w.]*[ \t]*=[ \t]*"
+    rf"""(?:"(?P<env_double>(?:\\.|[^"\\\n])*)"|'(?P<env_single>[^'\n]*)'|(?P<env>{unquoted})){line_end}"""
+)
+yaml_scalar = rf"^[ \t]*(?:-[ \t]+)?[\w.\-]+[ \t]*:[ \t]+(?!['\"\[\]{{}}|>&*!#])(?P<yaml>{unquoted}){line_end}"
+ini_value = rf"^[ \t]*[\w.\-]+[ \t]*[=:][ \t]*(?![#;])(?P<ini>{unquoted}){line_end}"
+
+
+def _compile(*parts: str) -> re.Pattern:
+    return re.compile("|".join(parts), re.MULTILINE)
+
+
+languages = {
+    "python": _compile(triple_quoted, double_quoted, single_quoted),
+    "js": _compile(template, double_quoted, single_quoted),
+    "json": _compile(json_key, double_quoted),
+    "yaml": _compile(double_quoted, single_quoted, yaml_scalar),
+    "env": _compile(env_assignment),
+    "ini": _compile(double_quoted, single_quoted, ini_value),
+    "default": _compile(double_quoted, single_quoted, r"`(?P<backtick>[^`\n]*)`"),
+}
+
+suffixes = {
+    ".py": "python", ".pyi": "python", ".pyw": "python",
+    ".js": "js", ".jsx": "js", ".mjs": "js", ".cjs": "js", ".ts": "js", ".tsx": "js",
+    ".json": "json",
+    ".yml": "yaml", ".yaml": "yaml",
+    ".env": "env",
+    ".ini": "ini", ".cfg": "ini", ".conf": "ini", ".properties": "ini", ".toml": "ini",
+}
+
+value_groups = ["triple", "template", "double", "single", "backtick", "env_double", "env_single", "env", "yaml", "ini"]
+
+
+def language_of(path: Optional[PurePath]) -> str:
+    if path is None:
+        return "default"
+    if path.name.startswith(".env"):  # .env, .env.local, ...
+        return "env"
+    return suffixes.get(path.suffix.lower(), "default")
+
+
+def extract(text: str, language: str = "default") -> Iterator[Literal]:
+    """Yield every string literal (and unquoted assigned value) in the buffer, in a single pass."""
+    for match in languages[language].finditer(text):
+        for group in value_groups:
+            value = match.groupdict().get(group)
+            if value is not None:
+                break
+        else:
+            continue
+        start = match.start(group)
+        if "\n" not in value:
+            yield Literal(value, start)
+            continue
+        # multi-line literals are split into their lines
+        offset = 0
+        for line in value.split("\n"):
+            stripped = line.strip()
+            if stripped:
+                yield Literal(stripped, start + offset + line.index(stripped))
+            offset += len(line) + 1
@@ -0,0 +1,98 @@
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import f1_score
+from sklearn.model_selection import train_test_split
+
+from finney.models.decision_tree import Model, model_path, save_model, short_words
+from finney.models.features import data_dir, get_features, measure_costs, registry
+
+dataset_path = "/finney/data/PassFInder_Password_Dataset/password_test.csv"
+
+# smaller than the final model, since the search trains one model per feature it tries to drop
+search_params = {"eta": 0.3, "max_depth": 8, "n_estimators": 100}
+final_params = {"eta": 0.05, "max_depth": 15, "n_estimators": 1000}
+
+
+def _log(message: str) -> None:
+    now = datetime.now()
+    print(f"[{now.hour:0>2}:{now.minute:0>2}:{now.second:0>2}] {message}")
+
+
+def importance(model: Model) -> dict[str, float]:
+    """Each feature's share of the model's total gain. Features the model never splits on get 0."""
+    scores = model.model.get_booster().get_score(importance_type="total_gain")
+    by_name = {}
+    for i, name in enumerate(model.features):
+        by_name[name] = scores.get(name, scores.get(f"f{i}", 0.0))  # models trained on arrays name features f0, f1...
+    total = sum(by_name.values()) or 1.0
+    return {name: gain / total for name, gain in by_name.items()}
+
+
+def train(word_features: pd.DataFrame, labels: np.ndarray, params: dict) -> tuple[xgb.XGBClassifier, float]:
+    """Train on a fixed split and return the model, with its test F1 computed the same way as in `make_tree`."""
+    X_train, X_test, y_train, y_test = train_test_split(word_features, labels, test_size=0.2, random_state=42)
+    clf = xgb.XGBClassifier(**params).fit(X_train, y_train)
+    return clf, f1_score(y_test > 0, clf.predict(X_test) > 0, average="macro")
+
+
+def prune(
+        word_features: pd.DataFrame,
+        labels: np.ndarray,
+        costs: dict[str, float],
+        importances: dict[str, float],
+        tolerance: float = 0.01,
+        params: dict = search_params,
+) -> tuple[list[str], float, float]:
+    """Greedily drop features, the ones with the least importance per second of compute first,
+    as long as the F1 stays within `tolerance` of that of the full feature set.
+
+    Returns the kept features, and the F1 with all features and with the kept ones.
+    """
+    kept = list(word_features.columns)
+    _, baseline = train(word_features, labels, params)
+    _log(f"F1 with all {len(kept)} features: {baseline:.4f}")
+    f1 = baseline
+    for name in sorted(kept, key=lambda n: importances.get(n, 0.0) / max(costs[n], 1e-12)):
+        if len(kept) == 1:
+            break
+        candidate = [n for n in kept if n != name]
+        _, candidate_f1 = train(word_features[candidate], labels, params)
+        if candidate_f1 >= baseline - tolerance:
+            kept, f1 = candidate, candidate_f1
+            _log(f"Dropped {name} ({costs[name] * 1e6:.1f}us per candidate), F1 {candidate_f1:.4f}")
+    return kept, baseline, f1
+
+
+def main(dataset: str = dataset_path, tolerance: float = 0.01, output: str = model_path) -> None:
+    df = pd.read_csv(dataset, header=None, names=["text", "label"]).dropna()
+    snippet_words = list(pd.read_csv(data_dir / "context_words.csv"))
+    texts = pd.DataFrame(df["text"].astype(str).tolist() + short_words + snippet_words, columns=["text"])
+    labels = np.array(df["label"].astype(int).tolist() + [0] * (len(short_words) + len(snippet_words)))
+
+    _log("Computing features")
+    word_features = get_features(texts)
+    costs = measure_costs(texts.sample(min(len(texts), 20_000), random_state=42))
+
+    clf, _ = train(word_features, labels, search_params)
+    importances = importance(Model(clf, "", tuple(word_features.columns)))
+    kept, baseline, f1 = prune(word_features, labels, costs, importances, tolerance)
+
+    print(f"{'feature':<30}{'us/candidate':>14}{'importance':>12}  kept")
+    for name in registry:
+        print(f"{name:<30}{costs[name] * 1e6:>14.1f}{importances.get(name, 0.0):>12.4f}  {'yes' if name in kept else 'no'}")
+    total, pruned = sum(costs.values()), sum(costs[n] for n in kept)
+    _log(f"Kept {len(kept)} of {len(costs)} features, F1 {baseline:.4f} -> {f1:.4f}, "
+         f"feature time {total * 1e6:.1f}us -> {pruned * 1e6:.1f}us per candidate")
+
+    _log("Retraining on the kept features")
+    clf, test_f1 = train(word_features[kept], labels, final_params)
+    save_model(clf, kept, output, test_f1=test_f1, feature_costs={n: costs[n] for n in kept})
+    _log(f"Saved a model with test F1 {test_f1:.4f} to {output}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2], *map(float, sys.argv[2:3]))
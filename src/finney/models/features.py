@@ -1,40 +1,53 @@
 import re
+import time
 from collections import defaultdict
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence
 
 import numpy as np
 import pandas as pd
 
-english_words = set()
-with open("src/finney/data/words.txt", "r") as f:
-    for line in f.readlines():
-        english_words.add(line.strip().casefold())
-temp = "|".join(map(re.escape, english_words))
-english_pattern = re.compile(rf"\b(?:{temp})\b")
-
-keywords = set()
-with open("src/finney/data/keywords.txt", "r") as f:  # taken from https://github.com/e3b0c442/keywords?tab=readme-ov-file
-    for line in f.readlines():  # and from https://www.ibm.com/docs/en/i/7.6.0?topic=extensions-standard-c-library-functions-table-by-name
-        keywords.add(line.strip().casefold())
-temp = "|".join(map(re.escape, keywords))
-keyword_pattern = re.compile(rf"\b(?:{temp})\b")
-
-extensions = set()  # taken from https://gist.github.com/securifera/e7eed730cbe1ce43d0c29d7cd2d582f4
-with open("src/finney/data/extensions.txt", "r") as f:
-    for line in f.readlines():
-        extensions.add(line.strip().casefold())
-temp = "|".join(map(re.escape, extensions))
-file_type_pattern = re.compile(rf"(?:{temp})$")
-
-domains = set()  # taken from https://github.com/datasets/top-level-domain-names/blob/main/data/top-level-domain-names.csv?plain=1
-with open("src/finney/data/domains.txt", "r") as f:
-    for line in f.readlines():
-        domains.add(line.strip().casefold())
-temp = "|".join(map(re.escape, domains))
-url_pattern = re.compile(rf"(?:{temp})\b")
-
-key_distances = pd.read_csv("src/finney/data/bigrams.csv", index_col=0).to_numpy()
+data_dir = Path(__file__).parent.parent / "data"
+
 key_index = {ch: i for i, ch in enumerate("!@#$%^&*()_+1234567890-=qwertyuiop[]{}asdfghjkl;'\\:\"|~zxcvbnm,./<>?)}")}
 
+
+def _read_words(name: str) -> set[str]:
+    with open(data_dir / name, "r") as f:
+        return {line.strip().casefold() for line in f.readlines()}
+
+
+def _alternation(words: set[str], template: str) -> re.Pattern:
+    return re.compile(template.format("|".join(map(re.escape, words))))
+
+
+@dataclass(frozen=True)
+class Dictionaries:
+    english_pattern: re.Pattern
+    keyword_pattern: re.Pattern
+    file_type_pattern: re.Pattern
+    url_pattern: re.Pattern
+    key_distances: np.ndarray
+
+
+@lru_cache(maxsize=None)
+def load_dictionaries() -> Dictionaries:
+    """Load and compile the word lists the features are computed against. Done once per process."""
+    return Dictionaries(
+        english_pattern=_alternation(_read_words("words.txt"), r"\b(?:{})\b"),
+        # taken from https://github.com/e3b0c442/keywords?tab=readme-ov-file
+        # and from https://www.ibm.com/docs/en/i/7.6.0?topic=extensions-standard-c-library-functions-table-by-name
+        keyword_pattern=_alternation(_read_words("keywords.txt"), r"\b(?:{})\b"),
+        # taken from https://gist.github.com/securifera/e7eed730cbe1ce43d0c29d7cd2d582f4
+        file_type_pattern=_alternation(_read_words("extensions.txt"), r"(?:{})$"),
+        # taken from https://github.com/datasets/top-level-domain-names/blob/main/data/top-level-domain-names.csv?plain=1
+        url_pattern=_alternation(_read_words("domains.txt"), r"(?:{})\b"),
+        key_distances=pd.read_csv(data_dir / "bigrams.csv", index_col=0).to_numpy(),
+    )
+
+
 character_type_map = defaultdict(int)
 for c in "abcdefghijklmnopqrstuvwxyz":
     character_type_map[c] = 1
@@ -49,7 +62,9 @@ def extract_bigrams(word: str) -> list[tuple[str, str]]:
     return list(zip(word, word[1:]))
 
 
-def avg_key_distance(bigrams: list[tuple[str, str]]) -> np.float32:
+def avg_key_distance(bigrams: list[tuple[str, str]], key_distances: Optional[np.ndarray] = None) -> np.float32:
+    if key_distances is None:
+        key_distances = load_dictionaries().key_distances
     total_distance = np.float32(0)
     if not bigrams:
         return total_distance
@@ -84,100 +99,55 @@ def has_consecutive_sequence(trigrams: list[tuple[str, str, str]]) -> bool:
     return False
 
 
-def get_features(df: pd.DataFrame) -> pd.DataFrame:
-    out = pd.DataFrame()
+class _Shared:
+    """The candidates, plus intermediate values that several features use, each computed at most once."""
 
-    # contains special character
-    out["special"] = df["text"].str.contains("[!@#\$\^\&\*\(\)_\+\[\]'\"\;\/\,\>\<\\\|\{\}\?\.]", regex=True)
+    def __init__(self, df: pd.DataFrame, dictionaries: Dictionaries, names: Sequence[str]):
+        self.text = df["text"]
+        self.str_text = df["text"].astype(str)
+        self.dictionaries = dictionaries
+        self.names = set(names)
 
-    # ends with special character
-    out["special_end"] = df["text"].str.contains("[^a-zA-Z0-9]$", regex=True)
+    @cached_property
+    def bigrams(self) -> pd.Series:
+        # split the word into bigrams (e.g. "bigram" -> [bi, ig, gr, ra, am])
+        return self.text.map(lambda word: extract_bigrams(word))
 
-    # starts with uppercase
-    out["upper_start"] = df["text"].str.contains("^[A-Z]", regex=True)
+    @cached_property
+    def trigrams(self) -> pd.Series:
+        # split the word into trigrams (e.g. "trigram" -> [tri, rig, igr, gra, ram])
+        return self.text.map(lambda word: extract_trigrams(word))
 
-    # contains a space
-    # df["space"] = df["text"].str.contains(" ")
+    @cached_property
+    def likely_url(self) -> pd.Series:
+        return self.str_text.str.contains(self.dictionaries.url_pattern, na=False)
 
-    # is entirely hexadecimal, with at least one non-digit character
-    out["all_hexa"] = df["text"].str.contains("^[0-9A-Fa-f]*[A-Fa-f][0-9A-Fa-f]*$", regex=True)
+    def dictionary_matches(self, pattern: re.Pattern, count_name: str) -> pd.Series:
+        # when the count is computed anyway, whether there's any match follows from it without a second pass
+        if count_name in self.names:
+            return self.dictionary_count(pattern) > 0
+        return self.str_text.str.contains(pattern, na=False, regex=True)
 
-    # contains escaped byte (e.g. for urls)
-    out["byte"] = df["text"].str.contains(r"\\{1,2}\w{3,4}(?!\w)", regex=True)
-
-    # starts with one of . .. ./ ../ like a relative path path
-    out["path_sub"] = df["text"].str.contains(r"(?:^/\./)|(?:^\./)", regex=True)
-    out["path_relative"] = df["text"].str.contains(r"(?:^/\.\./)|(?:^\.\./)", regex=True)
+    def dictionary_count(self, pattern: re.Pattern) -> pd.Series:
+        cache = self.__dict__.setdefault("_counts", {})
+        if pattern not in cache:
+            cache[pattern] = self.str_text.str.findall(pattern).str.len()
+        return cache[pattern]
 
-    # is of common password format: [letters][numbers][symbol] or [letters][symbol][number]
-    out["letter_number_symbol"] = df["text"].str.contains(r"^[A-Za-z]+[0-9]+\W?$", regex=True)
-    out["letter_symbol_number"] = df["text"].str.contains(r"^[A-Za-z]+\W?[0-9]+$", regex=True)
 
-    # contains a number of a recent or upcoming year (1900-2100), or a date formatted YYYY-MM-DD
-    out["year"] = df["text"].str.contains(r"\b(?:19[0-9]{2}|20[0-9]{2}|2100)\b", regex=True)
-    out["date"] = df["text"].str.contains(r"\d{4}-\d{2}-\d{2}", regex=True)
+def _contains(pattern: str, regex: bool = True) -> Callable[[_Shared], pd.Series]:
+    return lambda s: s.text.str.contains(pattern, regex=regex)
 
-    # contains an xml/html tag (e.g. <div>)
-    out["xml"] = df["text"].str.contains(r"<.{1,3}>", regex=True)
 
-    # contains specific special characters that are kinda common in code
-    out["period"] = df["text"].str.contains("\.")
-    out["double_colon"] = df["text"].str.contains("::")
-    out["question"] = df["text"].str.contains("\?")
-    out["percent"] = df["text"].str.contains("%")
-    out["arrow"] = df["text"].str.contains("->")
-    out["dunder"] = df["text"].str.contains("__")
-    out["double_equal"] = df["text"].str.contains("==")
-    out["triple_equal"] = df["text"].str.contains("===")
-    out["double_slash"] = df["text"].str.contains("//")
-    out["backslash"] = df["text"].str.contains("\\\\")
-    out["double_backslash"] = df["text"].str.contains("\\\\\\\\")
-    out["newline"] = df["text"].str.contains(r"\\n", regex=True)
+def _longest(pattern: str) -> Callable[[_Shared], pd.Series]:
+    return lambda s: s.text.apply(lambda x: max((len(m) for m in re.findall(pattern, str(x))), default=0))
 
-    # contains an equal number of opening and closting parentheses of various types
-    out["balanced_parentheses"] = (
-            (df["text"].str.count(r"\(") == df["text"].str.count(r"\)")) &
-            (df["text"].str.count(r"\(") > 0)
-    )
-    out["balanced_parentheses_square"] = (
-            (df["text"].str.count(r"\[") == df["text"].str.count(r"\]")) &
-            (df["text"].str.count(r"\[") > 0)
-    )
-    out["balanced_parentheses_curl"] = (
-            (df["text"].str.count(r"\{") == df["text"].str.count(r"\}")) &
-            (df["text"].str.count(r"\{") > 0)
-    )
-
-    # longest sequence of uppercase letters, vowels, consonants, and hexadecimal characters
-    out["longest_upper"] = df["text"].apply(
-        lambda x: max((len(m) for m in re.findall(r"[A-Z]+", str(x))), default=0)
-    )
-    out["longest_vowels"] = df["text"].apply(
-        lambda x: max((len(m) for m in re.findall(r"[aeiouAEIOU]+", str(x))), default=0)
-    )
-    out["longest_cons"] = df["text"].apply(
-        lambda x: max((len(m) for m in re.findall(r"[bcdfghjklmnpqrstvxzBCDFGHJKLMNPQRSTVXZ]+", str(x))), default=0)
-    )
-    out["longest_hexa"] = df["text"].apply(
-        lambda x: max((len(m) for m in re.findall(r"[0-9A-Fa-f]*[A-Fa-f][0-9A-Fa-f]*", str(x))), default=0)
-    )
 
-    # fraction of the string that's digits, letters, and other
-    out["digit_fraction"] = df["text"].apply(
-        lambda x: sum(c.isdigit() for c in str(x)) / len(str(x))
-    )
-    out["vowel_fraction"] = df["text"].apply(
-        lambda x: sum(c in set("aeiouAEIOU") for c in str(x)) / len(str(x))
-    )
-    out["nonword_fraction"] = df["text"].apply(
-        lambda x: len(re.findall(r"\W", str(x))) / len(str(x))
-    )
+def _balanced(opening: str, closing: str) -> Callable[[_Shared], pd.Series]:
+    return lambda s: (s.text.str.count(opening) == s.text.str.count(closing)) & (s.text.str.count(opening) > 0)
 
-    # number of character sequences of length divisible by 4
-    out["word_length_mod_4"] = df["text"].apply(
-        lambda x: sum(1 for m in re.findall(r"\w+", str(x)) if len(m) % 4 == 0)
-    )
 
+def _format(s: _Shared) -> np.ndarray:
     # whether the string is in a common programming style convention
     snake = r'^[A-Za-z]+(?:_[A-Za-z_]+)+$'
     pascal = r'^[A-Z][a-z]+(?:[A-Z][a-z]+)+$'  # UpperCamel
@@ -186,39 +156,117 @@ def get_features(df: pd.DataFrame) -> pd.DataFrame:
     allcaps = r'^[A-Z]+$'  # ALLCAPS
 
     conds = [
-        df["text"].str.fullmatch(snake, na=False),
-        df["text"].str.fullmatch(pascal, na=False),
-        df["text"].str.fullmatch(camel, na=False),
-        df["text"].str.fullmatch(kebab, na=False),
-        df["text"].str.fullmatch(allcaps, na=False),
+        s.text.str.fullmatch(snake, na=False),
+        s.text.str.fullmatch(pascal, na=False),
+        s.text.str.fullmatch(camel, na=False),
+        s.text.str.fullmatch(kebab, na=False),
+        s.text.str.fullmatch(allcaps, na=False),
     ]
-    out["format"] = np.select(conds, [1, 2, 3, 4, 5], default=0).astype(int)
+    return np.select(conds, [1, 2, 3, 4, 5], default=0).astype(int)
 
-    # whether the string contains an english word, and how many
-    out["word"] = df["text"].astype(str).str.contains(english_pattern, na=False, regex=True)
-    out["word_count"] = df["text"].astype(str).str.findall(english_pattern).str.len()
 
+# every feature the model can be trained on, by name, in the order of the bundled model's columns
+registry: dict[str, Callable[[_Shared], Any]] = {
+    # contains special character
+    "special": _contains(r"[!@#\$\^\&\*\(\)_\+\[\]'\"\;\/\,\>\<\\|\{\}\?\.]"),
+    # ends with special character
+    "special_end": _contains("[^a-zA-Z0-9]$"),
+    # starts with uppercase
+    "upper_start": _contains("^[A-Z]"),
+    # is entirely hexadecimal, with at least one non-digit character
+    "all_hexa": _contains("^[0-9A-Fa-f]*[A-Fa-f][0-9A-Fa-f]*$"),
+    # contains escaped byte (e.g. for urls)
+    "byte": _contains(r"\\{1,2}\w{3,4}(?!\w)"),
+    # starts with one of . .. ./ ../ like a relative path path
+    "path_sub": _contains(r"(?:^/\./)|(?:^\./)"),
+    "path_relative": _contains(r"(?:^/\.\./)|(?:^\.\./)"),
+    # is of common password format: [letters][numbers][symbol] or [letters][symbol][number]
+    "letter_number_symbol": _contains(r"^[A-Za-z]+[0-9]+\W?$"),
+    "letter_symbol_number": _contains(r"^[A-Za-z]+\W?[0-9]+$"),
+    # contains a number of a recent or upcoming year (1900-2100), or a date formatted YYYY-MM-DD
+    "year": _contains(r"\b(?:19[0-9]{2}|20[0-9]{2}|2100)\b"),
+    "date": _contains(r"\d{4}-\d{2}-\d{2}"),
+    # contains an xml/html tag (e.g. <div>)
+    "xml": _contains(r"<.{1,3}>"),
+    # contains specific special characters that are kinda common in code
+    "period": _contains(r"\."),
+    "double_colon": _contains("::"),
+    "question": _contains(r"\?"),
+    "percent": _contains("%"),
+    "arrow": _contains("->"),
+    "dunder": _contains("__"),
+    "double_equal": _contains("=="),
+    "triple_equal": _contains("==="),
+    "double_slash": _contains("//"),
+    "backslash": _contains("\\\\"),
+    "double_backslash": _contains("\\\\\\\\"),
+    "newline": _contains(r"\\n"),
+    # contains an equal number of opening and closting parentheses of various types
+    "balanced_parentheses": _balanced(r"\(", r"\)"),
+    "balanced_parentheses_square": _balanced(r"\[", r"\]"),
+    "balanced_parentheses_curl": _balanced(r"\{", r"\}"),
+    # longest sequence of uppercase letters, vowels, consonants, and hexadecimal characters
+    "longest_upper": _longest(r"[A-Z]+"),
+    "longest_vowels": _longest(r"[aeiouAEIOU]+"),
+    "longest_cons": _longest(r"[bcdfghjklmnpqrstvxzBCDFGHJKLMNPQRSTVXZ]+"),
+    "longest_hexa": _longest(r"[0-9A-Fa-f]*[A-Fa-f][0-9A-Fa-f]*"),
+    # fraction of the string that's digits, letters, and other
+    "digit_fraction": lambda s: s.text.apply(lambda x: sum(c.isdigit() for c in str(x)) / len(str(x))),
+    "vowel_fraction": lambda s: s.text.apply(lambda x: sum(c in set("aeiouAEIOU") for c in str(x)) / len(str(x))),
+    "nonword_fraction": lambda s: s.text.apply(lambda x: len(re.findall(r"\W", str(x))) / len(str(x))),
+    # number of character sequences of length divisible by 4
+    "word_length_mod_4": lambda s: s.text.apply(lambda x: sum(1 for m in re.findall(r"\w+", str(x)) if len(m) % 4 == 0)),
+    "format": _format,
+    # whether the string contains an english word, and how many
+    "word": lambda s: s.dictionary_matches(s.dictionaries.english_pattern, "word_count"),
+    "word_count": lambda s: s.dictionary_count(s.dictionaries.english_pattern),
     # whether the string contains a programming keyword, and how many
-    out["keyword"] = df["text"].astype(str).str.contains(keyword_pattern, na=False, regex=True)
-    out["keyword_count"] = df["text"].astype(str).str.findall(keyword_pattern).str.len()
-
+    "keyword": lambda s: s.dictionary_matches(s.dictionaries.keyword_pattern, "keyword_count"),
+    "keyword_count": lambda s: s.dictionary_count(s.dictionaries.keyword_pattern),
     # is a likely url
-    out["likely_url"] = df["text"].astype(str).str.contains(url_pattern, na=False)
-
-    # ends with known file suffix (e.g. .exe or .py)
-    out["file_suffix"] = df["text"].astype(str).str.contains(url_pattern, na=False)
-
+    "likely_url": lambda s: s.likely_url,
+    # meant to be whether it ends with a known file suffix, but it was always computed with the url
+    # pattern, so it's a copy of likely_url. Kept for the models trained with it, see file_type below
+    "file_suffix": lambda s: s.likely_url,
     # string length
-    out["string_length"] = df["text"].astype(str).str.len()
+    "string_length": lambda s: s.str_text.str.len(),
+    "key_distances": lambda s: [avg_key_distance(b, s.dictionaries.key_distances) for b in s.bigrams],
+    "type_switches": lambda s: list(map(count_type_switches, s.bigrams)),
+    "consecutive_sequence": lambda s: list(map(has_consecutive_sequence, s.trigrams)),
+}
+
+# the features of models saved without a feature list, which all predate the registry
+legacy_features = tuple(registry)
 
-    # split the word into bigrams (e.g. "bigram" -> [bi, ig, gr, ra, am])
-    bigrams = df.text.map(lambda word: extract_bigrams(word))
-    out["key_distances"] = list(map(avg_key_distance, bigrams))
-    out["type_switches"] = list(map(count_type_switches, bigrams))
+# ends with known file suffix (e.g. .exe or .py)
+registry["file_type"] = lambda s: s.str_text.str.contains(s.dictionaries.file_type_pattern, na=False)
 
-    # split the word into trigrams (e.g. "trigram" -> [tri, rig, igr, gra, ram])
-    trigrams = df.text.map(lambda word: extract_trigrams(word))
-    out["consecutive_sequence"] = list(map(has_consecutive_sequence, trigrams))
 
-    # return tuple(features)
+def get_features(
+        df: pd.DataFrame, dictionaries: Optional[Dictionaries] = None, names: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    """Compute the named features (every registered feature by default) of the strings in `df["text"]`."""
+    names = list(names if names is not None else registry)
+    shared = _Shared(df, dictionaries or load_dictionaries(), names)
+    out = pd.DataFrame()
+    for name in names:
+        out[name] = registry[name](shared)
     return out
+
+
+def measure_costs(df: pd.DataFrame, names: Optional[Sequence[str]] = None, repeats: int = 3) -> dict[str, float]:
+    """Time each feature on its own, in seconds per candidate (best of `repeats`).
+
+    Intermediate values are counted in the cost of every feature that uses them, since that's
+    what it would cost to keep the feature if the others were dropped.
+    """
+    d = load_dictionaries()
+    costs = {}
+    for name in names if names is not None else registry:
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            registry[name](_Shared(df, d, [name]))
+            best = min(best, time.perf_counter() - start)
+        costs[name] = best / max(len(df), 1)
+    return costs
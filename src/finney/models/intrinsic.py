@@ -1,44 +1,348 @@
 import re
+import threading
+import time
 from pathlib import Path
+from typing import Optional
 
-from ..domain_objects import IgnoreConfig
-
-regexes = [
-    r"[1-9][0-9]+-[0-9a-zA-Z]{40}",
-    r"EAACEdEose0cBA[0-9A-Za-z]+",
-    r"AIza[0-9A-Za-z\-_]{35}",
-    r"[0-9]+-[0-9A-Za-z_]{32}\.apps\.googleusercontent\.com",
-    r"sk_live_[0-9a-z]{32}",
-    r"sk_live_[0-9a-zA-Z]{24}",
-    r"rk_live_[0-9a-zA-Z]{24}",
-    r"sq0atp-[0-9A-Za-z\-_]{22}",
-    r"sq0csp-[0-9A-Za-z\-_]{43}",
-    r"access_token\$production\$[0-9a-z]{16}\$[0-9a-f]{32}",
-    r"amzn\.mws\.[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}",
-    r"SK[0-9a-fA-F]{32}",
-    r"key-[0-9a-zA-Z]{32}",
-    r"[0-9a-f]{32}-us[0-9]{1,2}",
-    r"AKIA[0-9A-Z]{16}",
-    # CC number
-    r"\b(?:4[0-9]{12}(?:[0-9]{3})?|[25][1-7][0-9]{14}|6(?:011|5[0-9][0-9])[0-9]{12}|3[47][0-9]{13}|3(?:0[0-5]|[68][0-9])[0-9]{11}|(?:2131|1800|35\d{3})\d{11})\b",
-    # phone number
-    r"\b\+((?:9[679]|8[035789]|6[789]|5[90]|42|3[578]|2[1-689])|9[0-58]|8[1246]|6[0-6]|5[1-8]|4[013-9]|3[0-469]|2[70]|7|1)(?:\W*\d){0,13}\d\b",
-    # email
-    r"(\b[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+\b)"
-]
+import yaml
+
+from ..domain_objects import IgnoreConfig, RuleConfig
+
+try:
+    from re import _parser as sre_parse  # python 3.11+
+except ImportError:
+    import sre_parse
+
+try:
+    import regex  # optional, its searches can be cut short when a file's time budget runs out
+except ImportError:
+    regex = None
+
+rules = {
+    "twitter-access-token": r"[1-9][0-9]+-[0-9a-zA-Z]{40}",
+    "facebook-access-token": r"EAACEdEose0cBA[0-9A-Za-z]+",
+    "google-api-key": r"AIza[0-9A-Za-z\-_]{35}",
+    "google-oauth-client-id": r"[0-9]+-[0-9A-Za-z_]{32}\.apps\.googleusercontent\.com",
+    "picatic-api-key": r"sk_live_[0-9a-z]{32}",
+    "stripe-api-key": r"sk_live_[0-9a-zA-Z]{24}",
+    "stripe-restricted-api-key": r"rk_live_[0-9a-zA-Z]{24}",
+    "square-access-token": r"sq0atp-[0-9A-Za-z\-_]{22}",
+    "square-oauth-secret": r"sq0csp-[0-9A-Za-z\-_]{43}",
+    "paypal-braintree-access-token": r"access_token\$production\$[0-9a-z]{16}\$[0-9a-f]{32}",
+    "amazon-mws-auth-token": r"amzn\.mws\.[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}",
+    "twilio-api-key": r"SK[0-9a-fA-F]{32}",
+    "mailgun-api-key": r"key-[0-9a-zA-Z]{32}",
+    "mailchimp-api-key": r"[0-9a-f]{32}-us[0-9]{1,2}",
+    "aws-access-key-id": r"AKIA[0-9A-Z]{16}",
+    "credit-card-number": r"\b(?:4[0-9]{12}(?:[0-9]{3})?|[25][1-7][0-9]{14}|6(?:011|5[0-9][0-9])[0-9]{12}|3[47][0-9]{13}|3(?:0[0-5]|[68][0-9])[0-9]{11}|(?:2131|1800|35\d{3})\d{11})\b",
+    "phone-number": r"\b\+((?:9[679]|8[035789]|6[789]|5[90]|42|3[578]|2[1-689])|9[0-58]|8[1246]|6[0-6]|5[1-8]|4[013-9]|3[0-469]|2[70]|7|1)(?:\W{0,2}\d){0,13}\d\b",
+    # only tried where a run of address characters starts, so a long run without an @ is walked once, not once per character
+    "email-address": r"(?<![a-zA-Z0-9_.+-])[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+\b",
+}
+regexes = list(rules.values())
+
+
+possessive_repeat = getattr(sre_parse, "POSSESSIVE_REPEAT", None)  # python 3.11+
+atomic_group = getattr(sre_parse, "ATOMIC_GROUP", None)
+repeats = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, possessive_repeat)
+single_chars = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+zero_width = (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+
+any_char = frozenset(range(256))  # character sets are approximated by the first 256 code points
+categories = {
+    sre_parse.CATEGORY_DIGIT: frozenset(c for c in any_char if chr(c).isdecimal()),
+    sre_parse.CATEGORY_SPACE: frozenset(c for c in any_char if chr(c).isspace()),
+    sre_parse.CATEGORY_WORD: frozenset(c for c in any_char if chr(c).isalnum() or chr(c) == "_"),
+}
+categories.update({
+    sre_parse.CATEGORY_NOT_DIGIT: any_char - categories[sre_parse.CATEGORY_DIGIT],
+    sre_parse.CATEGORY_NOT_SPACE: any_char - categories[sre_parse.CATEGORY_SPACE],
+    sre_parse.CATEGORY_NOT_WORD: any_char - categories[sre_parse.CATEGORY_WORD],
+})
+
+
+def _char_set(op, av) -> frozenset[int]:
+    if op == sre_parse.LITERAL:
+        return frozenset([av])
+    if op == sre_parse.NOT_LITERAL:
+        return any_char - {av}
+    if op != sre_parse.IN:
+        return any_char
+    chars, negate = set(), False
+    for item_op, item_av in av:
+        if item_op == sre_parse.NEGATE:
+            negate = True
+        elif item_op == sre_parse.LITERAL:
+            chars.add(item_av)
+        elif item_op == sre_parse.RANGE:
+            chars.update(range(item_av[0], min(item_av[1], 255) + 1))
+        else:
+            chars.update(categories.get(item_av, any_char))
+    return any_char - chars if negate else frozenset(chars)
+
+
+def _children(op, av) -> list:
+    if op in repeats:
+        return [av[2]]
+    if op == sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op == atomic_group:
+        return [av]
+    if op == sre_parse.BRANCH:
+        return av[1]
+    if op == sre_parse.GROUPREF_EXISTS:
+        return [branch for branch in av[1:] if branch is not None]
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    return []
+
+
+def _first(pattern) -> tuple[frozenset[int], bool]:
+    """The characters a pattern can start with, and whether it can match the empty string."""
+    first = frozenset()
+    for op, av in pattern:
+        if op in single_chars:
+            chars, empty = _char_set(op, av), False
+        elif op in zero_width:
+            chars, empty = frozenset(), True
+        elif op in repeats:
+            chars, empty = _first(av[2])
+            empty = empty or av[0] == 0
+        elif op in (sre_parse.SUBPATTERN, atomic_group, sre_parse.BRANCH, sre_parse.GROUPREF_EXISTS):
+            options = [_first(child) for child in _children(op, av)]
+            if op == sre_parse.GROUPREF_EXISTS and len(options) == 1:
+                options.append((frozenset(), True))  # no "else" branch
+            chars = frozenset().union(*(chars for chars, _ in options))
+            empty = any(empty for _, empty in options)
+        else:  # backreferences
+            chars, empty = any_char, True
+        first |= chars
+        if not empty:
+            return first, False
+    return first, True
+
+
+def _chars(pattern) -> frozenset[int]:
+    """All the characters a pattern can match."""
+    chars = frozenset()
+    for op, av in pattern:
+        if op in single_chars:
+            chars |= _char_set(op, av)
+        elif op == sre_parse.GROUPREF:
+            chars |= any_char
+        elif op not in zero_width:
+            chars = chars.union(*map(_chars, _children(op, av)))
+    return chars
+
+
+def _nested_repeat(pattern, in_repeat: bool = False) -> bool:
+    """Whether an unbounded repeat appears inside another repeat, like `(a+)+` or `(?:\\W*\\d){0,13}`.
+
+    Those are what makes a regex backtrack catastrophically: the engine tries every way of splitting
+    the input between the inner and the outer repeat before giving up.
+    """
+    for op, av in pattern:
+        if op in repeats:
+            _, high, sub = av
+            if in_repeat and high == sre_parse.MAXREPEAT:
+                return True
+            if _nested_repeat(sub, in_repeat or high > 1):
+                return True
+        elif any(_nested_repeat(child, in_repeat) for child in _children(op, av)):
+            return True
+    return False
+
+
+def _ambiguous_repeat(pattern, in_repeat: bool = False, follow: frozenset[int] = frozenset()) -> bool:
+    """Whether a repeat's body can match the same text in more than one way, like `(a|aa)+` (which is
+    parsed as `(a(?:|a))+`) or `(?:aa?)+`: alternatives that can start with the same character, or an
+    optional part that can start with what follows it, `follow` being what can come after `pattern`.
+
+    Every extra way doubles what the engine tries on each repetition before giving up.
+    """
+    for i, (op, av) in enumerate(pattern):
+        rest, rest_empty = _first(pattern[i + 1:])
+        after = rest | follow if rest_empty else rest
+        if op in repeats:
+            low, high, sub = av
+            if in_repeat and low < high and _first(sub)[0] & after:
+                return True
+            if _ambiguous_repeat(sub, in_repeat or high > 1, _first(sub)[0] | after if high > 1 else after):
+                return True
+        elif op == sre_parse.BRANCH:
+            options = [_first(branch) for branch in av[1]]
+            for j, (chars, empty) in enumerate(options):
+                for other_chars, other_empty in options[j + 1:]:
+                    if in_repeat and (chars & other_chars or (empty and other_chars & after)
+                                      or (other_empty and chars & after)):
+                        return True
+            if any(_ambiguous_repeat(branch, in_repeat, after) for branch in av[1]):
+                return True
+        elif any(_ambiguous_repeat(child, in_repeat, after) for child in _children(op, av)):
+            return True
+    return False
+
+
+def _adjacent_repeats(pattern) -> bool:
+    """Whether an unbounded repeat is followed by another one that can match the same characters, like
+    `\\d+\\d+x`: the engine tries every way of splitting a run of them between the two."""
+    open_chars = frozenset()  # what the unbounded repeats right before the current item can match
+    for op, av in pattern:
+        while op == sre_parse.SUBPATTERN and len(av[-1]) == 1:
+            op, av = av[-1][0]
+        if op in repeats and av[1] == sre_parse.MAXREPEAT:
+            first, empty = _first(av[2])
+            if first & open_chars:
+                return True
+            open_chars = _chars(av[2]) | (open_chars if empty or av[0] == 0 else frozenset())
+        elif not _first([(op, av)])[1]:
+            open_chars = frozenset()
+        if any(_adjacent_repeats(child) for child in _children(op, av)):
+            return True
+    return False
+
+
+def compile_rule(rule_id: str, pattern: str) -> re.Pattern:
+    """Compile a rule, refusing patterns that are invalid or prone to catastrophic backtracking."""
+    try:
+        parsed = sre_parse.parse(pattern)
+        compiled = re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"Rule '{rule_id}' isn't a valid regex: {e}")
+    if _nested_repeat(parsed):
+        raise ValueError(
+            f"Rule '{rule_id}' nests an unbounded repeat inside another repeat, which can make it hang "
+            f"on some inputs. Bound the inner repeat (e.g. {{0,2}} instead of *)"
+        )
+    if _ambiguous_repeat(parsed):
+        raise ValueError(
+            f"Rule '{rule_id}' repeats something that can match the same text in more than one way "
+            f"(like (a|aa)+), which can make it hang on some inputs. Make its alternatives start differently"
+        )
+    if _adjacent_repeats(parsed):
+        raise ValueError(
+            f"Rule '{rule_id}' has unbounded repeats next to each other that can match the same characters "
+            f"(like \\d+\\d+), which makes it slow on long inputs. Merge them, or bound one of them"
+        )
+    return compiled
+
+
+def _interruptible(compiled: re.Pattern):
+    """The same rule compiled with the regex module, or as is if the regex module doesn't support it."""
+    try:
+        return regex.compile(compiled.pattern, compiled.flags)
+    except regex.error:
+        return compiled
+
+
+def load_pack(path: str) -> dict[str, str]:
+    """Read a rule pack: a yaml file mapping rule ids to patterns."""
+    with open(path, "r") as f:
+        pack = yaml.safe_load(f) or {}
+    if not isinstance(pack, dict):
+        raise ValueError(f"Rule pack {path} should map rule ids to patterns")
+    return {str(rule_id): str(pattern) for rule_id, pattern in pack.items()}
+
+
+class RuleSet:
+    """The rules a scan runs, compiled once, along with how many matches each found and how long it took.
+
+    Rules run one after the other on each file. Once a file has used up `time_budget` seconds, the rules
+    that didn't run on it yet are skipped and counted, so that one pathological file can't stall a scan.
+    With the `regex` module installed, a rule is also stopped in the middle of its search, and skipped.
+    """
+
+    def __init__(self, config: RuleConfig = RuleConfig()):
+        self.sources = {rule_id: "builtin" for rule_id in rules}
+        patterns = dict(rules)
+        for path in config.packs:
+            pack = load_pack(path)
+            patterns.update(pack)
+            self.sources.update(dict.fromkeys(pack, path))
+        patterns.update(config.custom)
+        self.sources.update(dict.fromkeys(config.custom, "config"))
+
+        self.disabled = set(config.disabled)
+        self.time_budget = config.time_budget
+        self.rules = {
+            rule_id: compile_rule(rule_id, pattern)
+            for rule_id, pattern in patterns.items() if rule_id not in self.disabled
+        }
+        if regex is not None and self.time_budget is not None:
+            self.rules = {rule_id: _interruptible(compiled) for rule_id, compiled in self.rules.items()}
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.counters = {rule_id: {"matches": 0, "seconds": 0.0, "skipped": 0} for rule_id in self.rules}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["counters"], state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_counters()
+
+    def scan_text(self, data: str, ignored: IgnoreConfig) -> list[tuple[str, str]]:
+        """Return (rule id, matched string) pairs, at most one per rule."""
+        return self.run(data, ignored)[0]
+
+    def run(self, data: str, ignored: IgnoreConfig) -> tuple[list[tuple[str, str]], list[str]]:
+        """Return (rule id, matched string) pairs, at most one per rule, and the ids of the rules skipped
+        because the time budget ran out."""
+        matches = []
+        spent = {}
+        start = time.perf_counter()
+        for rule_id, pattern in self.rules.items():
+            rule_start = time.perf_counter()
+            if isinstance(pattern, re.Pattern):
+                mo = pattern.search(data)
+            else:
+                remaining = self.time_budget - (rule_start - start)
+                try:  # a budget of 0 still runs the first rule in full, like without the regex module
+                    mo = pattern.search(data, timeout=remaining if remaining > 0 else None)
+                except TimeoutError:
+                    break
+            spent[rule_id] = time.perf_counter() - rule_start
+            if mo:
+                match_str = mo.group()
+                if match_str not in ignored.strings and "\n" not in match_str:
+                    matches.append((rule_id, match_str))
+            if self.time_budget is not None and time.perf_counter() - start > self.time_budget:
+                break
+
+        skipped = [rule_id for rule_id in self.rules if rule_id not in spent]
+        with self._lock:
+            for rule_id, seconds in spent.items():
+                self.counters[rule_id]["seconds"] += seconds
+            for rule_id in skipped:
+                self.counters[rule_id]["skipped"] += 1
+            for rule_id, _ in matches:
+                self.counters[rule_id]["matches"] += 1
+        return matches, skipped
+
+    def stats(self) -> dict[str, dict]:
+        with self._lock:
+            return {rule_id: dict(counter) for rule_id, counter in self.counters.items()}
+
+
+builtin_rules: Optional[RuleSet] = None
 
 
 def scan(file_path: Path, ignored: IgnoreConfig) -> list[str]:
-    matches = []
     with open(file_path, "r+") as f:
         try:
             data = f.read()
         except:
             return []
-    for regex in regexes:
-        if mo := re.search(regex, data):
-            match_str = mo.group()
-            if match_str in ignored.strings or "\n" in match_str:
-                continue
-            matches.append(match_str)
-    return matches
+    return [match_str for _, match_str in scan_text(data, ignored)]
+
+
+def scan_text(data: str, ignored: IgnoreConfig) -> list[tuple[str, str]]:
+    """Return (rule id, matched string) pairs, at most one per rule, using the builtin rules."""
+    global builtin_rules
+    if builtin_rules is None:
+        builtin_rules = RuleSet()
+    return builtin_rules.scan_text(data, ignored)
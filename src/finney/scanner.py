@@ -0,0 +1,291 @@
+import codecs
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Sequence, Union
+
+import click
+
+from finney import archives, search
+from finney.domain_objects import (
+    ArchiveLimits, EarlyExit, EntropyThresholds, FileLimits, IgnoreConfig, Match, PartialScan, ReadAhead
+)
+from finney.models import decision_tree, entropy, features, intrinsic
+
+
+def _note(report: Optional[list[PartialScan]], path: Union[Path, str], reason: str) -> None:
+    """Record that a file wasn't fully scanned, or warn about it if nobody's keeping a report."""
+    if report is not None:
+        report.append(PartialScan(str(path), reason))
+    else:
+        click.echo(f"Warning: {path} {reason}", err=True)
+
+
+def decode(data: bytes, path: Union[Path, str], report: Optional[list[PartialScan]] = None) -> Optional[str]:
+    """Decode a file as UTF-8, replacing the bytes that aren't. Binary files (with a NUL byte near the
+    start, as git decides it) aren't decoded at all. Either way, it's noted."""
+    if b"\0" in data[:8000]:  # checked first, as NUL bytes are valid UTF-8
+        _note(report, path, "wasn't scanned, as it's binary")
+        return None
+    text = search.decode(data)
+    if text is not None:
+        return text
+    _note(report, path, "isn't valid UTF-8, its undecodable bytes were replaced before scanning")
+    return data.decode("utf-8", errors="replace")
+
+
+class Scanner:
+    """Everything a scan needs - ignore config, rules, model, dictionaries and score cache - loaded once,
+    so the same scanner can scan files, bytes, streams or candidate batches over and over.
+
+    Scanners don't touch the working directory, and are safe to share between threads: the only
+    state that changes after construction is the score cache and the statistics, which are locked.
+    """
+
+    def __init__(
+            self,
+            ignored: Optional[IgnoreConfig] = None,
+            threshold: float = 0.2,
+            entropy_thresholds: EntropyThresholds = EntropyThresholds(),
+            archive_limits: ArchiveLimits = ArchiveLimits(),
+            read_ahead: ReadAhead = ReadAhead(),
+            model_path: str = decision_tree.model_path,
+            score_cache: Optional[decision_tree.ScoreCache] = None,
+            early_exit: EarlyExit = EarlyExit(),
+            rules: Optional[intrinsic.RuleSet] = None,
+            file_limits: FileLimits = FileLimits(),
+    ):
+        self.ignored = ignored or IgnoreConfig(dirs=[], files=[], types=[], strings=[])
+        self.threshold = threshold
+        self.entropy_thresholds = entropy_thresholds
+        self.archive_limits = archive_limits
+        self.read_ahead = read_ahead
+        self.model_path = model_path
+        self.score_cache = score_cache if score_cache is not None else decision_tree.ScoreCache()
+        self.early_exit = early_exit
+        self.rules = rules if rules is not None else intrinsic.RuleSet()
+        self.file_limits = file_limits
+        self._load()
+
+    def _load(self):
+        self.model = decision_tree.load_model(self.model_path)
+        self.dictionaries = features.load_dictionaries()
+        self.keywords = search.load_keywords()
+        self.staged = decision_tree.StagedModel(self.model.model, self.early_exit.stages) if self.early_exit.enabled else None
+
+    def __getstate__(self):
+        # sent to worker processes without the heavy parts, which every process loads for itself
+        state = self.__dict__.copy()
+        for key in ("model", "dictionaries", "keywords", "staged", "score_cache"):
+            del state[key]
+        state["cache_size"] = self.score_cache.maxsize
+        return state
+
+    def __setstate__(self, state):
+        self.score_cache = decision_tree.ScoreCache(state.pop("cache_size"))
+        self.__dict__.update(state)
+        self._load()
+
+    @property
+    def model_version(self) -> str:
+        return self.model.version
+
+    def should_scan(self, path: Union[Path, str]) -> bool:
+        return search.should_scan(Path(path), self.ignored)
+
+    def score(self, candidates: Sequence[str]) -> list[str]:
+        """Return the candidate strings the model flags as secrets."""
+        return decision_tree.score_candidates(
+            candidates, self.threshold, self.model, self.score_cache, self.dictionaries, self.staged
+        )
+
+    def scan_text(
+            self, text: str, path: Union[Path, str] = "<text>", report: Optional[list[PartialScan]] = None
+    ) -> list[Match]:
+        """Scan the text with every detector, within the file limits.
+
+        A file over a limit is scanned less thoroughly rather than skipped, and noted in `report`.
+        """
+        path = Path(path)
+        limits = self.file_limits
+        start = time.perf_counter()
+        found, skipped = self.rules.run(text, self.ignored)
+        matches = [Match(path, s, rule=f"intrinsic:{rule}") for rule, s in found]
+        if skipped:
+            _note(report, path, f"wasn't matched against {len(skipped)} rules, as the rules' time budget ran out")
+        if len(text) > limits.max_size:
+            _note(report, path, f"was only matched against the rules, as it's over {limits.max_size} characters")
+            return search.locate(text, search.clean_matches(matches, self.keywords))
+
+        matches.extend(
+            Match(path, s, rule="entropy") for s in entropy.scan_text(text, self.ignored, self.entropy_thresholds)
+        )
+        candidates = decision_tree.find_candidates(text, self.entropy_thresholds.gate, path)
+        if len(candidates) > limits.max_candidates:
+            _note(report, path, f"had a sample of {limits.max_candidates} of its {len(candidates)} candidates scored")
+            step = len(candidates) / limits.max_candidates
+            candidates = [candidates[int(i * step)] for i in range(limits.max_candidates)]
+        batch = max(1, limits.batch_size)
+        for i in range(0, len(candidates), batch):
+            if time.perf_counter() - start > limits.max_seconds:
+                _note(report, path, f"had {i} of its {len(candidates)} candidates scored "
+                                    f"before running out of time ({limits.max_seconds}s)")
+                break
+            matches.extend(Match(path, s, rule="model") for s in self.score(candidates[i:i + batch]))
+        return search.locate(text, search.clean_matches(matches, self.keywords))
+
+    def scan_stream(
+            self,
+            chunks: Iterable[bytes],
+            name: str = "<stdin>",
+            window_size: int = 1 << 20,
+            report: Optional[list[PartialScan]] = None,
+    ) -> list[Match]:
+        """Scan a stream of byte chunks (stdin, `git diff` output, a log tail...) with bounded memory.
+
+        The stream is decoded incrementally and scanned in windows of about `window_size` characters,
+        cut on line boundaries. Lines longer than a window are cut with a small overlap between windows.
+        """
+        if window_size < 1:
+            raise ValueError(f"window_size should be at least 1, got {window_size}")
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        overlap = min(256, window_size // 2)  # smaller than the window, so cutting a long line always moves forward
+        matches = []
+        buffer = ""
+        first_line = 1
+
+        def scan_window(window: str):
+            for m in self.scan_text(window, name, report):
+                matches.append(Match(m.path, m.match, m.line + first_line - 1, m.commit, m.rule))
+
+        for chunk in chunks:
+            buffer += decoder.decode(chunk)
+            while len(buffer) >= window_size:
+                cut = buffer.rfind("\n", 0, window_size) + 1
+                if cut:
+                    scan_window(buffer[:cut])
+                    first_line += buffer.count("\n", 0, cut)
+                    buffer = buffer[cut:]
+                else:  # a single huge line
+                    scan_window(buffer[:window_size])
+                    buffer = buffer[window_size - overlap:]
+        buffer += decoder.decode(b"", final=True)
+        if buffer:
+            scan_window(buffer)
+        return list(dict.fromkeys(matches))  # keep the first occurrence of each finding
+
+    def scan_bytes(
+            self,
+            data: bytes,
+            name: str = "<bytes>",
+            window_size: int = 1 << 20,
+            report: Optional[list[PartialScan]] = None,
+    ) -> list[Match]:
+        view = memoryview(data)
+        chunks = (view[i:i + window_size] for i in range(0, len(view), window_size))
+        return self.scan_stream(chunks, name, window_size, report)
+
+    def archive_members(
+            self, files: Iterable[Path], report: Optional[list[PartialScan]] = None
+    ) -> Iterator[tuple[Path, str]]:
+        def on_skip(name: str, reason: str) -> None:
+            _note(report, name, reason)
+
+        for file in files:
+            try:
+                for name, data in archives.iter_archive(file, self.archive_limits, on_skip):
+                    if not self.should_scan(name.rsplit("!", 1)[1]):
+                        continue
+                    text = decode(data, name, report)
+                    if text is not None:
+                        yield Path(name), text
+            except Exception as e:  # e.g. a corrupt archive, whatever was read of it before is still scanned
+                _note(report, file, f"couldn't be read through: {type(e).__name__}: {e}")
+
+    def scan_file(self, path: Union[Path, str], report: Optional[list[PartialScan]] = None) -> list[Match]:
+        path = Path(path)
+        if not self.should_scan(path):
+            return []
+        if archives.is_archive(path):
+            return [
+                m for member, text in self.archive_members([path], report) for m in self.scan_text(text, member, report)
+            ]
+        text = decode(path.read_bytes(), path, report)
+        return self.scan_text(text, path, report) if text is not None else []
+
+    def scan_texts_parallel(
+            self,
+            items: Iterable[tuple[Path, str]],
+            workers: Optional[int] = None,
+            report: Optional[list[PartialScan]] = None,
+    ) -> Iterator[list[Match]]:
+        """Scan (path, text) pairs in worker processes, yielding each item's matches as it completes.
+
+        Only a bounded number of items is in flight at once, so `items` can be a lazy stream
+        (e.g. blobs read from git) without being held in memory all together.
+        """
+        workers = workers or os.cpu_count() or 1
+        max_pending = workers * 4
+
+        def collect(future) -> list[Match]:
+            matches, notes = future.result()
+            for note in notes:
+                _note(report, note.path, note.reason)
+            return matches
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self,)) as executor:
+            pending = set()
+            for path, text in items:
+                pending.add(executor.submit(_scan_in_worker, path, text))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield collect(future)
+            for future in pending:
+                yield collect(future)
+
+    def scan_files(
+            self,
+            paths: Sequence[Union[Path, str]],
+            show_progress: bool = False,
+            report: Optional[list[PartialScan]] = None,
+    ) -> list[Match]:
+        # skip and ignore decisions are all made before anything is read
+        files = [f for f in map(Path, paths) if self.should_scan(f)]
+        archive_files = [f for f in files if archives.is_archive(f)]  # scanned member by member below
+        files = [f for f in files if not archives.is_archive(f)]
+        matches = []
+        hide_bar = not show_progress or len(paths) < 10
+        with click.progressbar(
+                search.read_ahead(files, self.read_ahead), length=len(files), label="Scanning files",
+                hidden=hide_bar, show_pos=True
+        ) as bar:
+            for file, contents in bar:
+                try:
+                    text = decode(contents.result(), file, report)
+                    if text is None:
+                        continue
+                    matches.extend(self.scan_text(text, file, report))
+                except Exception as e:  # one file failing doesn't cost the results of all the others
+                    _note(report, file, f"wasn't scanned: {type(e).__name__}: {e}")
+        if archive_files:
+            for found in self.scan_texts_parallel(self.archive_members(archive_files, report), report=report):
+                matches.extend(found)
+        return list(set(matches))
+
+
+_worker_scanner: Optional[Scanner] = None
+
+
+def _init_worker(scanner: Scanner) -> None:
+    global _worker_scanner
+    _worker_scanner = scanner
+
+
+def _scan_in_worker(path: Path, text: str) -> tuple[list[Match], list[PartialScan]]:
+    report = []
+    try:
+        return _worker_scanner.scan_text(text, path, report), report
+    except Exception as e:
+        return [], report + [PartialScan(str(path), f"wasn't scanned: {type(e).__name__}: {e}")]
@@ -1,10 +1,12 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Sequence
+from typing import Iterable, Iterator, Optional, Sequence
 
-import click
-
-from finney.domain_objects import Match, IgnoreConfig
-from finney.models import intrinsic, decision_tree
+from finney.domain_objects import ArchiveLimits, EntropyThresholds, Match, IgnoreConfig, ReadAhead
+from finney.models import decision_tree
+from finney.models.features import data_dir
 
 
 def should_scan(file: Path, ignored: IgnoreConfig) -> bool:
@@ -22,25 +24,34 @@ def find_lines(matches: list[Match]) -> list[Match]:
     out = []
     for match in matches:
         with open(match.path, "r") as f:
-            for i, line in enumerate(f.readlines(), start=1):
-                if match.match in line:
-                    if "finney: ignore" not in line.casefold():
-                        out.append(Match(match.path, match.match, i))
-                    break
-            else:
-                raise ValueError(f"Expected to find suspected secret '{match.match}' in file '{match.path}'")
+            out.extend(locate(f.read(), [match]))
+    return out
+
+
+def locate(text: str, matches: list[Match]) -> list[Match]:
+    lines = [line.rstrip("\r") for line in text.split("\n")]  # splitlines() also splits on \x0c, \x85, \u2028...
+    out = []
+    for match in matches:
+        for i, line in enumerate(lines, start=1):
+            if match.match in line:
+                if "finney: ignore" not in line.casefold():
+                    out.append(Match(match.path, match.match, i, match.commit, match.rule))
+                break
+        else:
+            raise ValueError(f"Expected to find suspected secret '{match.match}' in file '{match.path}'")
     return out
 
 
-keywords = set()
-with open("src/finney/data/keywords.txt", "r") as f:  # taken from https://github.com/e3b0c442/keywords?tab=readme-ov-file
-    for line in f.readlines():
-        keywords.add(line.strip().casefold())
+@lru_cache(maxsize=None)
+def load_keywords() -> frozenset[str]:
+    with open(data_dir / "keywords.txt", "r") as f:  # taken from https://github.com/e3b0c442/keywords?tab=readme-ov-file
+        return frozenset(line.strip().casefold() for line in f.readlines())
 
 
-def clean_matches(matches: list[Match]) -> list[Match]:
+def clean_matches(matches: list[Match], keywords: Optional[frozenset[str]] = None) -> list[Match]:
+    keywords = keywords if keywords is not None else load_keywords()
     matches = [m for m in matches if m.match.casefold() not in keywords]
-    return list(set(matches))
+    return list(dict.fromkeys(matches))  # the first detector to find a string is the one credited for it
 
 
 def make_paths_relative(paths: list[Path]) -> list[Path]:
@@ -52,24 +63,95 @@ def make_paths_relative(paths: list[Path]) -> list[Path]:
         out.append(p.resolve(strict=False))
     return out
 
-def scan_files(paths: Sequence[str], ignored: IgnoreConfig) -> list[Match]:
-    files = [Path(f) for f in paths]
-    matches = []
-    hide_bar = len(paths) < 10
-    with click.progressbar(files, label="Scanning files", hidden=hide_bar, show_pos=True) as bar:
-        for file in bar:
-            if not should_scan(file, ignored):
-                continue
-            try:
-                res = intrinsic.scan(file, ignored)
-                matches.extend([Match(file, s) for s in res])
-
-                res = decision_tree.scan(file)
-                matches.extend([Match(file, s) for s in res])
-            except Exception as e:
-                print(f"Failed to scan {file}")
-                raise e
-    if len(matches) > 1000:
-        print("Collecting Results...")
-    matches = find_lines(clean_matches(matches))
-    return matches
+def decode(data: bytes) -> Optional[str]:
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def read_ahead(files: Sequence[Path], config: ReadAhead = ReadAhead()) -> Iterator[tuple[Path, Future]]:
+    """Yield each file along with a future of its contents, in order, while upcoming files are read
+    in background threads. The scan's CPU work and the reads overlap, instead of taking turns.
+
+    Files are read ahead only while the total size of the files read but not yet scanned stays under
+    `config.max_bytes`. A single file bigger than that is read once everything before it was scanned.
+    """
+    with ThreadPoolExecutor(max_workers=config.workers) as executor:
+        pending = deque()
+        buffered = 0
+        upcoming = iter(files)
+        next_file = next(upcoming, None)
+        while next_file is not None or pending:
+            while next_file is not None:
+                size = _file_size(next_file)
+                if pending and buffered + size > config.max_bytes:
+                    break
+                pending.append((next_file, size, executor.submit(next_file.read_bytes)))
+                buffered += size
+                next_file = next(upcoming, None)
+            file, size, future = pending.popleft()
+            yield file, future
+            buffered -= size  # the caller is done with it by the time it asks for the next file
+
+
+# The functions below scan with a fresh Scanner over the given configuration, sharing the module-level
+# score cache. Long-running callers should keep a Scanner of their own instead.
+def _scanner(ignored: IgnoreConfig, **options):
+    from finney.scanner import Scanner
+    return Scanner(ignored, score_cache=decision_tree.score_cache, **options)
+
+
+def scan_text(
+        path: Path, text: str, ignored: IgnoreConfig, thresholds: EntropyThresholds = EntropyThresholds()
+) -> list[Match]:
+    return _scanner(ignored, entropy_thresholds=thresholds).scan_text(text, path)
+
+
+def scan_stream(
+        chunks: Iterable[bytes],
+        ignored: IgnoreConfig,
+        name: str = "<stdin>",
+        window_size: int = 1 << 20,
+        thresholds: EntropyThresholds = EntropyThresholds(),
+) -> list[Match]:
+    return _scanner(ignored, entropy_thresholds=thresholds).scan_stream(chunks, name, window_size)
+
+
+def scan_bytes(
+        data: bytes,
+        ignored: IgnoreConfig,
+        name: str = "<bytes>",
+        window_size: int = 1 << 20,
+        thresholds: EntropyThresholds = EntropyThresholds(),
+) -> list[Match]:
+    return _scanner(ignored, entropy_thresholds=thresholds).scan_bytes(data, name, window_size)
+
+
+def scan_texts_parallel(
+        items: Iterable[tuple[Path, str]],
+        ignored: IgnoreConfig,
+        workers: Optional[int] = None,
+        thresholds: EntropyThresholds = EntropyThresholds(),
+) -> Iterator[list[Match]]:
+    return _scanner(ignored, entropy_thresholds=thresholds).scan_texts_parallel(items, workers)
+
+
+def scan_files(
+        paths: Sequence[str],
+        ignored: IgnoreConfig,
+        archive_limits: ArchiveLimits = ArchiveLimits(),
+        thresholds: EntropyThresholds = EntropyThresholds(),
+        read_ahead_config: ReadAhead = ReadAhead(),
+) -> list[Match]:
+    scanner = _scanner(
+        ignored, entropy_thresholds=thresholds, archive_limits=archive_limits, read_ahead=read_ahead_config
+    )
+    return scanner.scan_files(paths, show_progress=True)
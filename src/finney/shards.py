@@ -0,0 +1,88 @@
+import json
+import os
+from hashlib import sha1
+from pathlib import PurePath
+from typing import Sequence
+
+import click
+
+from finney.domain_objects import Match, PartialScan
+
+format_version = 1
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse an `i/N` shard spec, where shards are numbered 1 to N."""
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise click.BadParameter(f"expected a shard like 1/4, got '{value}'")
+    if count < 1 or not 1 <= index <= count:
+        raise click.BadParameter(f"shard {value} is out of range, expected 1/{max(count, 1)} to {max(count, 1)}/{max(count, 1)}")
+    return index, count
+
+
+def shard_of(path: str, count: int) -> int:
+    """The 1-based shard a path belongs to. Depends only on the normalized path, so every machine agrees."""
+    key = PurePath(os.path.normpath(path)).as_posix().encode("utf-8", errors="surrogateescape")
+    return int.from_bytes(sha1(key).digest()[:8], "big") % count + 1
+
+
+def relative_path(path: str, roots: Sequence[str] = ()) -> str:
+    """The path relative to the deepest of `roots` (the scanned directories) it's under, or to the working
+    directory, so that runners with their checkouts in different places still agree on the split."""
+    full = os.path.abspath(path)
+    containing = [r for r in map(os.path.abspath, roots) if os.path.commonpath([r, full]) == r]
+    return os.path.relpath(full, max(containing, key=len) if containing else os.curdir)
+
+
+def select(paths: Sequence[str], index: int, count: int, roots: Sequence[str] = ()) -> list[str]:
+    return [p for p in paths if shard_of(relative_path(p, roots), count) == index]
+
+
+def write_partial(
+        path: str,
+        index: int,
+        count: int,
+        files: int,
+        matches: Sequence[Match],
+        partial: Sequence[PartialScan] = (),
+) -> None:
+    result = {
+        "version": format_version,
+        "shard": index,
+        "shards": count,
+        "files": files,
+        "matches": [m.to_dict() for m in matches],
+        "partial": [{"path": p.path, "reason": p.reason} for p in partial],
+    }
+    with open(path, "w+") as f:
+        json.dump(result, f, indent=1)
+
+
+def read_partial(path: str) -> dict:
+    with open(path, "r") as f:
+        result = json.load(f)
+    if result.get("version") != format_version:
+        raise click.ClickException(f"{path} isn't a finney shard result, or was written by another version")
+    return result
+
+
+def merge(paths: Sequence[str]) -> tuple[list[Match], int, list[int], list[PartialScan]]:
+    """Combine partial results into (deduplicated matches, files scanned, missing shard numbers,
+    files that weren't fully scanned)."""
+    results = [read_partial(p) for p in paths]
+    counts = {r["shards"] for r in results}
+    if len(counts) > 1:
+        raise click.ClickException(f"Can't merge results of runs split into different numbers of shards: {sorted(counts)}")
+
+    seen = set()
+    for path, result in zip(paths, results):
+        if result["shard"] in seen:
+            raise click.ClickException(f"Shard {result['shard']}/{result['shards']} was given more than once ({path})")
+        seen.add(result["shard"])
+
+    matches = list(dict.fromkeys(Match.from_dict(m) for r in results for m in r["matches"]))
+    missing = sorted(set(range(1, counts.pop() + 1)) - seen) if results else []
+    partial = [PartialScan(p["path"], p["reason"]) for r in results for p in r.get("partial", [])]
+    return matches, sum(r["files"] for r in results), missing, partial
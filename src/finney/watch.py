@@ -0,0 +1,155 @@
+import os
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, Optional
+
+from finney.domain_objects import Match
+from finney.scanner import Scanner
+
+
+def _walk(paths: Iterable[str], recursive: bool, scanner: Scanner) -> Iterator[str]:
+    """The files under `paths` that the scanner would scan, without descending into ignored directories."""
+    for path in paths:
+        if recursive and os.path.isdir(path):
+            for dir_path, dir_names, files in os.walk(path):
+                dir_names[:] = [d for d in dir_names if d not in scanner.ignored.dirs]  # e.g. .git, node_modules
+                for name in files:
+                    file = os.path.normpath(os.path.join(dir_path, name))
+                    if scanner.should_scan(file):
+                        yield file
+        elif os.path.isfile(path) and scanner.should_scan(path):
+            yield os.path.normpath(path)
+
+
+def _snapshot(paths: Iterable[str], recursive: bool, scanner: Scanner) -> dict[str, tuple[int, int]]:
+    out = {}
+    for path in _walk(paths, recursive, scanner):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        out[path] = (stat.st_mtime_ns, stat.st_size)
+    return out
+
+
+def _poll(
+        paths: list[str],
+        recursive: bool,
+        scanner: Scanner,
+        changed: queue.Queue,
+        stop: threading.Event,
+        interval: float,
+) -> None:
+    """Compare file modification times every `interval` seconds, for when watchdog isn't installed."""
+    before = _snapshot(paths, recursive, scanner)
+    while not stop.wait(interval):
+        after = _snapshot(paths, recursive, scanner)
+        for path in before.keys() | after.keys():
+            if before.get(path) != after.get(path):
+                changed.put(path)
+        before = after
+
+
+def _observe(paths: list[str], recursive: bool, changed: queue.Queue):
+    """Get change notifications from the OS (inotify, FSEvents, ...) through watchdog."""
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory or event.event_type in ("opened", "closed_no_write"):
+                return
+            changed.put(os.path.normpath(event.src_path))
+            if getattr(event, "dest_path", ""):
+                changed.put(os.path.normpath(event.dest_path))
+
+    observer = Observer()
+    handler = Handler()
+    if recursive:
+        for path in paths:
+            observer.schedule(handler, path, recursive=True)
+    else:  # single files are watched through their directories, and other files' events filtered out
+        for directory in {os.path.dirname(path) or "." for path in paths}:
+            observer.schedule(handler, directory, recursive=False)
+    observer.start()
+    return observer
+
+
+def _batches(changed: queue.Queue, debounce: float) -> Iterator[set[str]]:
+    """Yield the paths that changed, once no more changes came in for `debounce` seconds."""
+    while True:
+        batch = {changed.get()}  # blocks without using any CPU until something changes
+        while True:
+            try:
+                batch.add(changed.get(timeout=debounce))
+            except queue.Empty:
+                break
+        yield batch
+
+
+def watch(
+        paths: list[str],
+        scanner: Scanner,
+        recursive: bool = False,
+        debounce: float = 0.3,
+        poll_interval: float = 1.0,
+        on_change: Optional[Callable[[list[Match], list[Match], dict[str, set[Match]]], None]] = None,
+) -> dict[str, set[Match]]:
+    """Scan the paths, then rescan each file whenever it changes, until interrupted.
+
+    After every rescan, `on_change` gets the new findings, the resolved ones, and all current findings by file.
+    Returns the findings when interrupted (with Ctrl+C).
+    """
+    paths = [os.path.normpath(p) for p in paths]
+    files = {os.path.abspath(p) for p in paths}
+    dirs = [os.path.abspath(p) for p in paths if recursive and os.path.isdir(p)]
+    absolute = all(os.path.isabs(p) for p in paths)
+
+    def tracked(path: str) -> bool:
+        full = os.path.abspath(path)
+        if full not in files and not any(os.path.commonpath([d, full]) == d for d in dirs):
+            return False
+        return scanner.should_scan(path)
+
+    def as_given(path: str) -> str:  # findings are reported in the same form as the given paths
+        return os.path.abspath(path) if absolute else os.path.relpath(path)
+
+    findings: dict[str, set[Match]] = {}
+    for m in scanner.scan_files([p for p in _walk(paths, recursive, scanner) if tracked(p)]):
+        findings.setdefault(str(m.path).split("!", 1)[0], set()).add(m)  # archive members under their archive
+    if on_change:
+        on_change([m for found in findings.values() for m in found], [], findings)
+
+    changed = queue.Queue()
+    stop = threading.Event()
+    try:
+        observer = _observe(paths, recursive, changed)
+    except ImportError:
+        observer = None
+        threading.Thread(
+            target=_poll, args=(paths, recursive, scanner, changed, stop, poll_interval), daemon=True
+        ).start()
+
+    try:
+        for batch in _batches(changed, debounce):
+            new, resolved = [], []
+            for path in sorted({as_given(p) for p in batch if tracked(p)}):
+                try:
+                    found = set(scanner.scan_file(path)) if os.path.isfile(path) else set()
+                except OSError:
+                    continue  # e.g. deleted again before it was read, the next event will tell
+                old = findings.pop(path, set())
+                if found:
+                    findings[path] = found
+                new.extend(found - old)
+                resolved.extend(old - found)
+            if on_change and (new or resolved):
+                on_change(new, resolved, findings)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        if observer is not None:
+            observer.stop()
+            observer.join()
+    return findings
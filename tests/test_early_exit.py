@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+
+from finney.models.decision_tree import StagedModel, clean_results
+
+
+def train(classes: int) -> tuple[xgb.XGBClassifier, pd.DataFrame]:
+    """A small model on synthetic features, where class 0 is easy to tell apart so many rows exit early,
+    and rows to score with it."""
+    rng = np.random.default_rng(42)
+    features = pd.DataFrame(rng.normal(size=(2000, 6)), columns=[f"feature_{i}" for i in range(6)])
+    scores = 3 * features["feature_0"] + features["feature_1"] + rng.normal(scale=0.3, size=2000)
+    labels = np.digitize(scores, np.quantile(scores, np.linspace(0, 1, classes + 1)[1:-1]))
+    model = xgb.XGBClassifier(n_estimators=200, max_depth=3, eta=0.1).fit(features, labels)
+    return model, pd.DataFrame(rng.normal(size=(3000, 6)), columns=features.columns)
+
+
+@pytest.fixture(scope="module", params=[2, 3], ids=["binary", "3 classes"])
+def trained(request):
+    return train(request.param)
+
+
+@pytest.mark.parametrize("threshold", [0.01, 0.2, 0.5, 0.9])
+@pytest.mark.parametrize("stages", [(0.1, 0.25, 0.5), (0.5,), (0.01, 0.99), (0.2, 0.4, 0.6, 0.8)])
+def test_early_exit_flags_the_same_rows_as_the_full_model(trained, threshold, stages):
+    model, features = trained
+    expected = clean_results(model.predict_proba(features), threshold)
+    assert sorted(StagedModel(model, stages).flagged(features, threshold)) == expected
+
+
+def test_early_exit_decides_rows_early(trained):
+    model, features = trained
+    staged = StagedModel(model)
+    staged.flagged(features, 0.2)
+    assert staged.stats()["exit_rate"] > 0  # otherwise the test above never compares an early decision
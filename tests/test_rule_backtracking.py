@@ -0,0 +1,48 @@
+import pytest
+
+from finney.models.intrinsic import RuleSet, compile_rule, rules
+
+
+@pytest.mark.parametrize("pattern", [
+    r"(a+)+",
+    r"(\w+\s?)*",
+    r"(?:\W*\d){0,13}",
+    r"(a|aa)+b",
+    r"(?:aa?)+",
+    r"(\d|\d\d)+x",
+    r"\d+\d+x",
+    r"\d+\s*\d+",
+    r"(\d+)(\d+)",
+    r"\w*\d+",
+    r"(?>a+)+",
+    r"(a)?(?(1)b+|c)+",
+])
+def test_rejects_patterns_that_backtrack_catastrophically(pattern):
+    with pytest.raises(ValueError):
+        compile_rule("rule", pattern)
+
+
+@pytest.mark.parametrize("pattern", [
+    r"\s*\S+",
+    r'"[^"]*"',
+    r"[a-z]+@[a-z]+",
+    r"\d+-\d+",
+    r"\w+\d",
+    r"(?:a|b)+",
+    r"(?:ab|ac)+",
+    r"(foo|foobar)*",
+    r'(?:\\.|[^"\\])*',
+    r"(?:\W{0,2}\d){0,13}",
+    r"key-[0-9a-z]{32}",
+])
+def test_accepts_patterns_that_match_in_one_way(pattern):
+    compile_rule("rule", pattern)
+
+
+@pytest.mark.parametrize("rule_id", list(rules))
+def test_accepts_builtin_rules(rule_id):
+    compile_rule(rule_id, rules[rule_id])
+
+
+def test_builtin_rule_set_loads():
+    assert set(RuleSet().rules) == set(rules)